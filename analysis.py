@@ -0,0 +1,218 @@
+import re
+import gzip
+import pickle
+import struct
+import bisect
+import numpy as np
+
+# Snowball stemmer for more accurate stemming; created on first use, as importing nltk takes over
+# a second and search.py only stems query words missing from the saved stem cache
+stemmer = None
+
+# scikit-learn's default token pattern: runs of 2 or more word characters
+token_pattern = re.compile(r"(?u)\b\w\w+\b")
+
+# maximum number of distinct words kept in a stem cache
+STEM_CACHE_SIZE = 500000
+
+# stemming backends; each stems a list of words in one call
+def snowball_stem_words(words):
+    global stemmer
+    if stemmer is None:
+        from nltk.stem.snowball import SnowballStemmer
+        stemmer = SnowballStemmer("english")
+    return [stemmer.stem(word) for word in words]
+
+pystemmer = None
+
+# PyStemmer (bundled by scripts/bundle.py) stems a whole batch of words in C
+def pystemmer_stem_words(words):
+    global pystemmer
+    if pystemmer is None:
+        import Stemmer
+        pystemmer = Stemmer.Stemmer("english")
+    return pystemmer.stemWords(words)
+
+STEM_BACKENDS = {"snowball": snowball_stem_words, "pystemmer": pystemmer_stem_words}
+
+#### STEM TABLE FORMAT (single file, little-endian)
+# a saved stem cache, looked up in place so search never decodes the whole cache:
+# header: magic, format version, number of words, byte offsets of the sections below
+# backend: utf-8 name of the stemming backend
+# word offsets int64[n_words + 1] and stem offsets int64[n_words + 1]: into the blobs below
+# utf-8 word blob: words in sorted order; utf-8 stem blob: stem of each word, in the same order
+
+MAGIC = b"STEMS\0\0\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQQQQQ")
+
+# read-only table of the words of a saved cache and their stems, held in a buffer (e.g. a section of
+# an index segment); a word is only decoded when it is indexed, so a lookup (a binary search)
+# decodes about log2(n_words) words
+class StemTable:
+    def __init__(self, buffer):
+        (magic, version, _, n_words, backend_offset, backend_length, word_offsets_offset, stem_offsets_offset,
+         words_offset, stems_offset) = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a stem table (or unsupported version)")
+        self.buffer = buffer
+        self.backend = bytes(buffer[backend_offset:backend_offset + backend_length]).decode("utf-8")
+        self.word_offsets = np.frombuffer(buffer, dtype="<i8", count=n_words + 1, offset=word_offsets_offset)
+        self.stem_offsets = np.frombuffer(buffer, dtype="<i8", count=n_words + 1, offset=stem_offsets_offset)
+        self.words_offset = words_offset
+        self.stems_offset = stems_offset
+
+    def __len__(self):
+        return len(self.word_offsets) - 1
+
+    # i-th word in sorted order
+    def __getitem__(self, i):
+        return self.string(self.words_offset, self.word_offsets, i)
+
+    def string(self, blob_offset, offsets, i):
+        return bytes(self.buffer[blob_offset + int(offsets[i]):blob_offset + int(offsets[i + 1])]).decode("utf-8")
+
+    # stem of word, or None if word is not in the table
+    def get(self, word):
+        i = bisect.bisect_left(self, word)
+        if i < len(self) and self[i] == word:
+            return self.string(self.stems_offset, self.stem_offsets, i)
+        return None
+
+    # every (word, stem) pair, in sorted word order
+    def items(self):
+        return ((self[i], self.string(self.stems_offset, self.stem_offsets, i)) for i in range(len(self)))
+
+    # words are written sorted, so the same stems always give the same bytes (words are cached in a
+    # different order by serial and parallel builds)
+    @staticmethod
+    def write(path, backend, stems):
+        words = sorted(stems)
+        encoded_backend = backend.encode("utf-8")
+        encoded_words = [word.encode("utf-8") for word in words]
+        encoded_stems = [stems[word].encode("utf-8") for word in words]
+        word_offsets = np.zeros(len(words) + 1, dtype="<i8")
+        np.cumsum([len(word) for word in encoded_words], out=word_offsets[1:])
+        stem_offsets = np.zeros(len(words) + 1, dtype="<i8")
+        np.cumsum([len(stem) for stem in encoded_stems], out=stem_offsets[1:])
+
+        backend_offset = HEADER.size
+        # keep the offset arrays 8-byte aligned
+        word_offsets_offset = (backend_offset + len(encoded_backend) + 7) // 8 * 8
+        stem_offsets_offset = word_offsets_offset + word_offsets.nbytes
+        words_offset = stem_offsets_offset + stem_offsets.nbytes
+        stems_offset = words_offset + int(word_offsets[-1])
+        with open(path, "wb") as stems_file:
+            stems_file.write(HEADER.pack(MAGIC, VERSION, 0, len(words), backend_offset, len(encoded_backend),
+                                         word_offsets_offset, stem_offsets_offset, words_offset, stems_offset))
+            stems_file.write(encoded_backend)
+            stems_file.write(b"\0" * (word_offsets_offset - stems_file.tell()))
+            stems_file.write(word_offsets.tobytes())
+            stems_file.write(stem_offsets.tobytes())
+            stems_file.write(b"".join(encoded_words))
+            stems_file.write(b"".join(encoded_stems))
+
+# memoizing stemming layer; legal text repeats the same surface forms over and over,
+# so most words are stemmed once and then looked up
+# the cache is bounded: once it holds max_size words, new words are still stemmed but not cached
+# a cache loaded with an index keeps its saved words in a StemTable, mapped with the index, and only
+# copies a word into stems when it is looked up
+class StemCache:
+    def __init__(self, backend="snowball", max_size=STEM_CACHE_SIZE, stems=None, table=None):
+        if backend not in STEM_BACKENDS:
+            raise ValueError("unknown stemmer: " + backend)
+        self.backend = backend
+        self.stem_backend = STEM_BACKENDS[backend]
+        self.max_size = max_size
+        self.stems = {} if stems is None else stems
+        self.table = table
+        # words cached since last call to drain(); used to collect caches of worker processes
+        self.new_stems = {}
+        self.hits = 0
+        self.misses = 0
+
+    # stem a list of words; words missing from the cache are sent to the backend as one batch
+    def stem_words(self, words):
+        stems = self.stems
+        result = [stems.get(word) for word in words]
+        if self.table is not None and None in result:
+            for word in dict.fromkeys(word for word, stem in zip(words, result) if stem is None):
+                stem = self.table.get(word)
+                if stem is not None:
+                    stems[word] = stem
+            result = [stems.get(word) for word in words]
+        missing = list(dict.fromkeys(word for word, stem in zip(words, result) if stem is None))
+        if not missing:
+            self.hits += len(words)
+            return result
+
+        missing_stems = dict(zip(missing, self.stem_backend(missing)))
+        self.add(missing_stems)
+        misses = sum(stem is None for stem in result)
+        self.misses += misses
+        self.hits += len(words) - misses
+        return [missing_stems[word] if stem is None else stem for word, stem in zip(words, result)]
+
+    def stem(self, word):
+        return self.stem_words([word])[0]
+
+    # cache stems, up to max_size words
+    def add(self, stems):
+        # words of the saved table count towards max_size, as they are saved again with the new ones
+        saved = 0 if self.table is None else len(self.table)
+        for word, stem in stems.items():
+            if saved + len(self.stems) >= self.max_size:
+                break
+            if word not in self.stems:
+                self.stems[word] = stem
+                self.new_stems[word] = stem
+
+    # return (and forget) words cached and hit/miss counts since the last drain
+    def drain(self):
+        delta = (self.new_stems, self.hits, self.misses)
+        self.new_stems = {}
+        self.hits = self.misses = 0
+        return delta
+
+    # merge what another cache drained (e.g. a worker process's cache) into this one
+    def absorb(self, delta):
+        stems, hits, misses = delta
+        self.add(stems)
+        self.hits += hits
+        self.misses += misses
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    # save cache with the index as a stem table, so query-time stemming of common words is a lookup
+    def save(self, path):
+        StemTable.write(path, self.backend, self.all_stems())
+
+    # every cached word and its stem: the saved table's words, and the words cached since it was loaded
+    def all_stems(self):
+        stems = dict(self.table.items()) if self.table is not None else {}
+        stems.update(self.stems)
+        return stems
+
+    # cache saved by save(), held in a buffer (e.g. a section of an index segment)
+    # caches saved by older builds are gzip-pickled dicts; those are decoded in full
+    @classmethod
+    def from_buffer(cls, buffer):
+        if bytes(buffer[:2]) == b"\x1f\x8b":
+            saved = pickle.loads(gzip.decompress(buffer))
+            return cls(saved["backend"], stems=saved["stems"])
+        table = StemTable(buffer)
+        return cls(table.backend, table=table)
+
+# cache used by analyze(); index.py and search.py replace it to pick a backend or load a saved cache
+stem_cache = StemCache()
+
+def set_stem_cache(cache):
+    global stem_cache
+    stem_cache = cache
+
+# case-fold, tokenize and stem text
+# produces exactly the terms TfidfStemVectorizer's analyzer produces, without going through scikit-learn
+def analyze(text):
+    return stem_cache.stem_words(token_pattern.findall(text.lower()))
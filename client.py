@@ -0,0 +1,81 @@
+import sys
+import json
+import time
+import socket
+import getopt
+
+# default socket file, shared with server.py (not imported from there, so the client stays light)
+SOCKET_FILE = 'search.sock'
+
+# thin client for server.py; a drop-in for search.py's -q/-o interface
+# -d and -p are accepted so existing search.py command lines keep working, but the server's index is used
+def usage():
+    print("usage: " + sys.argv[0] + " [-s socket-file] [-k n] -q file-of-queries -o output-file-of-results")
+
+# send the lines of a query file to the server, return ranked docIds
+def query_server(socket_file, content, k=None):
+    request = {"query": content}
+    if k != None:
+        request["k"] = k
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_file)
+        connection.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with connection.makefile("rb") as server_file:
+            response = json.loads(server_file.readline())
+    if "error" in response:
+        raise RuntimeError("server error: " + response["error"])
+    return response["results"]
+
+if __name__ == '__main__':
+    socket_file = SOCKET_FILE
+    file_of_queries = file_of_output = top_k = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:s:k:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-q':
+            file_of_queries = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '-s':
+            socket_file = a
+        elif o == '-k':
+            try:
+                top_k = int(a)
+            except ValueError:
+                top_k = 0
+        elif o in ('-d', '-p'):
+            pass
+        else:
+            assert False, "unhandled option"
+
+    if file_of_queries == None or file_of_output == None:
+        usage()
+        sys.exit(2)
+    if top_k != None and top_k < 1:
+        print("-k must be at least 1")
+        usage()
+        sys.exit(2)
+
+    start_time = time.time()
+    with open(file_of_queries) as query_file:
+        content = query_file.readlines()
+    try:
+        result_docs = query_server(socket_file, content, top_k)
+    except (ConnectionError, FileNotFoundError):
+        print("no search server listening on", socket_file + "; start one with server.py")
+        sys.exit(1)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    print(len(result_docs), "matching documents found.")
+    print("writing to file...")
+    with open(file_of_output, 'w') as output_file:
+        output_file.write(" ".join(result_docs))
+    print("done.")
+    print(file_of_output, "generated.")
+    print("search completed in", round(time.time() - start_time, 5), "secs.")
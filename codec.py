@@ -0,0 +1,151 @@
+import numpy as np
+
+# integer codecs shared by the on-disk index formats
+# all functions work on whole numpy arrays at once; no per-integer python loops
+
+# encode an array of non-negative integers as variable-byte (LEB128) integers
+# each byte stores 7 bits of the value, low bits first; the high bit is set on every byte but the last
+def varint_encode(values):
+    values = np.asarray(values, dtype=np.uint64)
+    if values.size == 0:
+        return b""
+    # number of bytes needed by each value (at least 1, at most 10 for 64-bit values)
+    lengths = np.ones(values.shape, dtype=np.int64)
+    remaining = values >> np.uint64(7)
+    while remaining.any():
+        lengths += remaining > 0
+        remaining >>= np.uint64(7)
+
+    # byte offset at which each value starts in the output
+    starts = np.zeros(values.shape, dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(int(lengths.max())):
+        # values that still have a k-th byte to write
+        mask = lengths > k
+        chunk = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        # set continuation bit unless this is the value's last byte
+        chunk |= np.where(lengths[mask] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[starts[mask] + k] = chunk.astype(np.uint8)
+    return out.tobytes()
+
+# decode a buffer of variable-byte integers back into a uint64 array
+def varint_decode(buffer):
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if data.size == 0:
+        return np.empty(0, dtype=np.uint64)
+    # a value ends on every byte without the continuation bit
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # shift each byte by 7 bits times its index within its value, then OR the bytes of each value together
+    lengths = ends - starts + 1
+    byte_index = np.arange(data.size) - np.repeat(starts, lengths)
+    shifted = (data & 0x7F).astype(np.uint64) << (np.uint64(7) * byte_index.astype(np.uint64))
+    return np.bitwise_or.reduceat(shifted, starts)
+
+# decode count variable-byte integers starting at offset in buffer
+# returns them and the offset of the first byte after them, for formats that store other data after varints
+def varint_decode_from(buffer, count, offset=0):
+    if count == 0:
+        return np.empty(0, dtype=np.uint64), offset
+    # a value is at most 10 bytes long
+    data = np.frombuffer(buffer, dtype=np.uint8, count=min(10 * count, len(buffer) - offset), offset=offset)
+    end = int(np.flatnonzero(data < 0x80)[count - 1]) + 1
+    return varint_decode(data[:end]), offset + end
+
+# number of significant bits of each value (0 for 0)
+def bit_lengths(values):
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.zeros(values.shape, dtype=np.int64)
+    remaining = values.copy()
+    while remaining.any():
+        lengths += remaining > 0
+        remaining >>= np.uint64(1)
+    return lengths
+
+# pack values into width bits each, low bits first
+def bitpack(values, width):
+    bits = (np.asarray(values, dtype=np.uint64)[:, None] >> np.arange(width, dtype=np.uint64)) & np.uint64(1)
+    return np.packbits(bits.astype(np.uint8).ravel(), bitorder="little").tobytes()
+
+# inverse of bitpack: count values of width bits each
+def bitunpack(buffer, count, width):
+    bits = np.unpackbits(np.frombuffer(buffer, dtype=np.uint8), count=count * width, bitorder="little")
+    bits = bits.reshape(count, width).astype(np.uint64) << np.arange(width, dtype=np.uint64)
+    return np.bitwise_or.reduce(bits, axis=1) if width else np.zeros(count, dtype=np.uint64)
+
+#### PFOR (patched frame of reference) encoding
+# values are cut into blocks of PFOR_BLOCK_SIZE, and every full block is packed at a fixed width:
+#   [width of every block: 1 byte each][number of exceptions of every block: 1 byte each]
+#   [values of every block, width bits each: 16 * width bytes per block]
+#   [index within its block of every exception: 1 byte each][high bits (value >> width) of every exception: varints]
+#   [values after the last full block: varints, as packing a short block saves nothing]
+# width is chosen per block to minimize its size, so a few large values (exceptions) do not widen the
+# slots of all the others; the low width bits of an exception are kept in its slot
+# block headers come first so the decoder can find every block without walking them one by one, and
+# unpack all blocks of the same width at once
+PFOR_BLOCK_SIZE = 128
+
+# the narrowest width that minimizes the size of a block of values
+def pfor_width(values):
+    bits = bit_lengths(values)
+    best_width, best_size = 0, None
+    for width in np.unique(np.concatenate(([0], bits))).tolist():
+        exceptions = bits > width
+        size = PFOR_BLOCK_SIZE * width // 8 + int(exceptions.sum()) + \
+            int(np.maximum((bits[exceptions] - width + 6) // 7, 1).sum())
+        if best_size is None or size < best_size:
+            best_width, best_size = width, size
+    return best_width
+
+def pfor_encode(values):
+    values = np.asarray(values, dtype=np.uint64)
+    n_full = len(values) // PFOR_BLOCK_SIZE * PFOR_BLOCK_SIZE
+    blocks = values[:n_full].reshape(-1, PFOR_BLOCK_SIZE)
+    widths = [pfor_width(block) for block in blocks]
+    packed, exceptions, high = [], [], []
+    for block, width in zip(blocks, widths):
+        block_exceptions = np.flatnonzero(block >> np.uint64(width)) if width < 64 else np.empty(0, dtype=np.int64)
+        packed.append(bitpack(block & np.uint64((1 << width) - 1), width))
+        exceptions.append(block_exceptions)
+        high.append(block[block_exceptions] >> np.uint64(width))
+    if not widths:
+        return varint_encode(values)
+    return b"".join([bytes(widths), bytes(len(block_exceptions) for block_exceptions in exceptions)] + packed +
+                    [np.concatenate(exceptions).astype(np.uint8).tobytes(), varint_encode(np.concatenate(high)),
+                     varint_encode(values[n_full:])])
+
+# decode count values starting at offset in buffer; returns them and the offset after them
+def pfor_decode(buffer, count, offset=0):
+    n_blocks = count // PFOR_BLOCK_SIZE
+    if n_blocks == 0:
+        return varint_decode_from(buffer, count, offset)
+    widths = np.frombuffer(buffer, dtype=np.uint8, count=n_blocks, offset=offset).astype(np.int64)
+    n_exceptions = np.frombuffer(buffer, dtype=np.uint8, count=n_blocks, offset=offset + n_blocks).astype(np.int64)
+    offset += 2 * n_blocks
+    packed_sizes = PFOR_BLOCK_SIZE * widths // 8
+    packed_starts = offset + np.cumsum(packed_sizes) - packed_sizes
+    offset += int(packed_sizes.sum())
+
+    data = np.frombuffer(buffer, dtype=np.uint8, count=offset, offset=0)
+    values = np.zeros((n_blocks, PFOR_BLOCK_SIZE), dtype=np.uint64)
+    for width in np.unique(widths[widths > 0]).tolist():
+        blocks = np.flatnonzero(widths == width)
+        packed = data[(packed_starts[blocks][:, None] + np.arange(PFOR_BLOCK_SIZE * width // 8)).ravel()]
+        values[blocks] = bitunpack(packed, len(blocks) * PFOR_BLOCK_SIZE, width).reshape(len(blocks), -1)
+
+    total_exceptions = int(n_exceptions.sum())
+    exception_blocks = np.repeat(np.arange(n_blocks), n_exceptions)
+    exceptions = np.frombuffer(buffer, dtype=np.uint8, count=total_exceptions, offset=offset)
+    high, offset = varint_decode_from(buffer, total_exceptions, offset + total_exceptions)
+    values[exception_blocks, exceptions] |= high << widths[exception_blocks].astype(np.uint64)
+    tail, offset = varint_decode_from(buffer, count - n_blocks * PFOR_BLOCK_SIZE, offset)
+    return np.concatenate((values.ravel(), tail)), offset
+
+# codecs of postings formats: an encoder of an array, and a decoder of count values at an offset of a
+# buffer that returns them and the offset after them
+CODECS = ("varint", "pfor")
+ENCODERS = {"varint": varint_encode, "pfor": pfor_encode}
+DECODERS = {"varint": varint_decode_from, "pfor": pfor_decode}
@@ -0,0 +1,84 @@
+import os
+import struct
+import numpy as np
+
+#### DOC MAP FORMAT (single file, little-endian)
+# header: magic, format version, number of rows
+# ids int64[n_rows]: docId of every matrix row, in row order
+# order int64[n_rows]: rows sorted by (docId, row), so a docId is found with one binary search
+# ranks int64[n_rows]: position of every row's document in the order documents were read (the
+#   dataset, then updates); rows are in that order unless index.py --reorder assigned them in
+#   another, so search breaks ties between equal scores by rank instead of by row
+#   (version 1 files have no ranks: rows are in read order)
+# sorted_ids int64[n_rows]: docIds in order, i.e. ids[order], so opening a doc map does not gather them
+#   (version 1 and 2 files have no sorted_ids; they are gathered when the file is read)
+#
+# a docId can appear in more than one row after incremental updates (a replaced document keeps its
+# tombstoned old row); lookups return the newest row
+
+MAGIC = b"DOCMAP\0\0"
+VERSION = 3
+HEADER = struct.Struct("<8sIIQ")
+
+# docId <-> matrix row mapping
+class DocMap:
+    def __init__(self, ids, order=None, ranks=None, sorted_ids=None):
+        self.ids = ids
+        self.order = np.argsort(ids, kind="stable") if order is None else order
+        self.sorted_ids = ids[self.order] if sorted_ids is None else sorted_ids
+        self.ranks = np.arange(len(ids), dtype=np.int64) if ranks is None else ranks
+
+    # docIds are numeric in the dataset; stored as int64 instead of python strings
+    @classmethod
+    def from_ids(cls, doc_ids):
+        try:
+            return cls(np.array([int(doc_id) for doc_id in doc_ids], dtype=np.int64))
+        except ValueError:
+            raise ValueError("document IDs must be integers")
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        magic, version, _, n_rows = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version not in (1, 2, VERSION):
+            raise ValueError("not a doc map file (or unsupported version)")
+        ids = np.frombuffer(buffer, dtype="<i8", count=n_rows, offset=HEADER.size)
+        order = np.frombuffer(buffer, dtype="<i8", count=n_rows, offset=HEADER.size + 8 * n_rows)
+        ranks = sorted_ids = None
+        if version > 1:
+            ranks = np.frombuffer(buffer, dtype="<i8", count=n_rows, offset=HEADER.size + 16 * n_rows)
+        if version > 2:
+            sorted_ids = np.frombuffer(buffer, dtype="<i8", count=n_rows, offset=HEADER.size + 24 * n_rows)
+        return cls(ids, order, ranks, sorted_ids)
+
+    # written to a temp file first, as the arrays may be mapped from the file being replaced
+    def save(self, path):
+        temp_path = os.path.join(os.path.dirname(path), "temp-" + os.path.basename(path))
+        with open(temp_path, "wb") as map_file:
+            map_file.write(HEADER.pack(MAGIC, VERSION, 0, len(self.ids)))
+            map_file.write(np.asarray(self.ids, dtype="<i8").tobytes())
+            map_file.write(np.asarray(self.order, dtype="<i8").tobytes())
+            map_file.write(np.asarray(self.ranks, dtype="<i8").tobytes())
+            map_file.write(np.asarray(self.sorted_ids, dtype="<i8").tobytes())
+        os.replace(temp_path, path)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # docId (as written to results) of a row
+    def __getitem__(self, row):
+        return str(self.ids[row])
+
+    # newest row of each docId in doc_ids, or -1 for docIds not in the index
+    def rows(self, doc_ids):
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full(len(doc_ids), -1, dtype=np.int64)
+        i = np.searchsorted(self.sorted_ids, doc_ids, side="right") - 1
+        found = (i >= 0) & (self.sorted_ids[np.maximum(i, 0)] == doc_ids)
+        return np.where(found, self.order[np.maximum(i, 0)], -1)
+
+    def row(self, doc_id):
+        try:
+            return int(self.rows([int(doc_id)])[0])
+        except ValueError:
+            return -1
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+import numpy as np
+from segment import Segment
+from matrixfile import matrix_from_buffer
+from vocabulary import Vocabulary
+from synonyms import synonyms_from_buffer
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE = os.path.join(REPO_DIR, "sample.csv")
+
+def wordnet_available():
+    try:
+        from nltk.corpus import wordnet
+        wordnet.ensure_loaded()
+    except (ImportError, LookupError):
+        return False
+    return True
+
+# run index.py in directory with args, answering its overwrite prompt
+def run_index(directory, *args):
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, "index.py")] + list(args), cwd=directory,
+                   input="y\n", stdout=subprocess.DEVNULL, universal_newlines=True, check=True)
+
+# write the header and records[start:end] of sample.csv to path
+def write_records(path, start, end):
+    csv.field_size_limit(sys.maxsize)
+    with open(SAMPLE, newline="") as sample_file:
+        records = list(csv.reader(sample_file))
+    with open(path, "w", newline="") as part_file:
+        csv.writer(part_file, quoting=csv.QUOTE_ALL).writerows([records[0]] + records[1:][start:end])
+
+# {term: synonym term} of the index at postings
+def synonym_terms(postings):
+    segment = Segment.open(postings)
+    vocabulary = Vocabulary(segment.section('vocabulary'))
+    synonyms = synonyms_from_buffer(segment.section('synonyms'))
+    term_of = {int(vocabulary.columns[i]): vocabulary.terms[i] for i in range(vocabulary.n_terms)}
+    return {term_of[column]: term_of[synonym] for column, synonym in enumerate(synonyms.tolist()) if synonym != -1}
+
+class TestUpdate(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="index-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @unittest.skipUnless(wordnet_available(), "WordNet data not found")
+    def test_update_compact_synonyms_match_rebuild(self):
+        write_records(os.path.join(self.directory, "part1.csv"), 0, 7)
+        write_records(os.path.join(self.directory, "part2.csv"), 7, None)
+        run_index(self.directory, "-i", SAMPLE, "-d", "full.dict", "-p", "full.post", "--lazy-idf")
+        run_index(self.directory, "-i", "part1.csv", "-d", "dictionary.txt", "-p", "postings.txt", "--lazy-idf")
+        run_index(self.directory, "-u", "part2.csv", "-d", "dictionary.txt", "-p", "postings.txt")
+        run_index(self.directory, "--compact", "-d", "dictionary.txt", "-p", "postings.txt")
+
+        rebuilt = synonym_terms(os.path.join(self.directory, "full.post"))
+        self.assertTrue(rebuilt)
+        self.assertEqual(synonym_terms(os.path.join(self.directory, "postings.txt")), rebuilt)
+
+class TestDuplicates(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="index-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_duplicates_reported_next_to_postings(self):
+        csv.field_size_limit(sys.maxsize)
+        with open(SAMPLE, newline="") as sample_file:
+            records = list(csv.reader(sample_file))
+        with open(os.path.join(self.directory, "dup.csv"), "w", newline="") as dup_file:
+            csv.writer(dup_file, quoting=csv.QUOTE_ALL).writerows(records + records[1:3])
+        os.mkdir(os.path.join(self.directory, "index"))
+        run_index(self.directory, "-i", "dup.csv", "-d", "index/dictionary.txt", "-p", "index/postings.txt")
+
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "duplicates.txt")))
+        with open(os.path.join(self.directory, "index", "postings.txt.duplicates")) as report_file:
+            report = report_file.read().splitlines()
+        self.assertEqual(report[0], "doc_id,kept_row,duplicate_record")
+        self.assertEqual([line.split(",")[0] for line in report[1:]], [records[1][0], records[2][0]])
+
+class TestQuantize(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="index-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_float16_columns_stay_float16(self):
+        run_index(self.directory, "-i", SAMPLE, "-d", "dictionary.txt", "-p", "postings.txt", "--quantize", "float16")
+        segment = Segment.open(os.path.join(self.directory, "postings.txt"))
+        matrix = matrix_from_buffer(segment.section('matrix'))
+        columns = matrix_from_buffer(segment.section('columns'))
+        self.assertEqual(matrix.dtype, np.float16)
+        self.assertEqual(columns.dtype, np.float16)
+        self.assertEqual((columns.tocsr() != matrix).nnz, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,121 +1,497 @@
+import os
 import sys
+import json
 import getopt
 import csv
-import gzip
-import pickle
-import nltk
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-
-# Snowball stemmer for more accurate stemming
-stemmer = nltk.stem.snowball.SnowballStemmer("english")
-
-# modified version of TfidfVectorizer that converts list of text to a term-doc matrix
-# modified to use float32 to save space when saved to disk, and to stem all words automatically
-class TfidfStemVectorizer(TfidfVectorizer):
-    def __init__(self):
-        super().__init__(self, dtype=np.float32)
-        self.analyze = super().build_analyzer()
-
-    # function that processes all text passed to vectorizer when called
-    def build_analyzer(self):
-        # automatically stem all words in text passed to it
-        return lambda doc: (stemmer.stem(word) for word in self.analyze(doc))
+from scipy import sparse
+import analysis
+from analysis import StemCache
+from vectorizer import TfidfStemVectorizer
+from inverter import Inverter, SpimiInverter, invert_parallel, merge_indexes
+from positional import PositionalIndex, PositionalIndexWriter, remap_rows
+from docmap import DocMap
+from matrixfile import save_matrix, matrix_from_buffer
+from scoring import save_max_impacts
+from codec import CODECS, varint_encode
+from quantize import QUANTIZATIONS, quantize, dequantize, csc_copy, save_scales, scales_from_buffer
+from ngrams import build_ngram_index
+from synonyms import build_synonyms, save_synonyms
+from tombstones import save_tombstones, tombstones_from_buffer
+from vocabulary import Vocabulary
+from segment import Segment, SECTIONS, VERSION as SEGMENT_VERSION, write_segment
 
 def usage():
-    print("usage: " + sys.argv[0] + " -i dataset-file -d dictionary-file -p postings-file")
+    print("usage: " + sys.argv[0] + " -i dataset-file -d dictionary-file -p postings-file [-j number-of-workers] [--memory-budget megabytes] [--stemmer snowball|pystemmer] [--lazy-idf] [--ngrams min-doc-freq] [--quantize uint8|uint16|float16] [--reorder] [--codec varint|pfor]")
+    print("       " + sys.argv[0] + " -u delta-dataset-file -d dictionary-file -p postings-file")
+    print("       " + sys.argv[0] + " --delete file-of-doc-ids -d dictionary-file -p postings-file")
+    print("       " + sys.argv[0] + " --compact -d dictionary-file -p postings-file")
+
+# read dataset, yielding docId, text (title, court and content fields), court and date of every document
+def read_dataset(in_dir):
+    with open(in_dir) as dataset:
+        csv.field_size_limit(sys.maxsize)
+        dataset_reader = csv.reader(dataset, delimiter=",")
+        column_no = 1
+        next(dataset) # skip header line
+        for line in dataset_reader:
+            print("\treading line", column_no); column_no += 1
+            doc_id = line[0]
+            title = line[1]
+            date = line[3] # not indexed; dates are most likely included in text already, only used by --reorder
+            court = line[4]
+            text = title + " " + court + " " + line[2] # add title and court to main text
+            yield (doc_id, text, court, date)
+        dataset.close()
 
 # main function to iterate through dataset, collect terms from case title, court and text fields
 # collect positions of these terms in dictionary, fit terms to document-term vector space matrix
-def build_index(in_dir, out_dict, out_postings):
+# with more than 1 worker, tokenizing and stemming is spread over a pool of processes
+# with a memory budget (in bytes), postings are flushed to temp block files and merged at the end
+# with lazy_idf, idf is kept out of the matrix so the index can later be updated incrementally
+# with ngram_min_df, an n-gram index of word pairs and triples in at least that many documents is built
+# with quantization (one of quantize.QUANTIZATIONS), document weights are stored quantized
+# with reorder, rows are assigned by court and date instead of in read order (see reorder_rows)
+# codec (one of codec.CODECS) encodes the integers of the positional and n-gram indexes
+def build_index(in_dir, out_dict, out_postings, workers=1, memory_budget=None, lazy_idf=False, ngram_min_df=None,
+                quantization=None, reorder=False, codec="varint"):
     # one last check before overwriting indices
     warning_check = input("are you sure you want to overwrite your index? y/n ")
     if warning_check != "y":
         print("closing...")
         sys.exit(2)
 
-    # to store text from each document
-    corpus = []
     # to store docId - row number mapping in matrix later
     docs = []
-    # store positions for every document each word is in
-    positions = {}
-    # case-fold and stem words; learn vocabulary to be fitted to matrix later
+    # hash table of docIds seen so far, to their row; used to detect duplicate documents in constant time
+    doc_rows = {}
+    # (docId, row of first copy, record number of duplicate) of every duplicate record
+    duplicates = []
+    # (court, date) of every document, in read order; the keys rows are reordered by
+    sort_keys = []
+    # case-fold and stem words; fitted from the collected term counts later
     vectorizer = TfidfStemVectorizer()
 
+    # text of every document to be indexed, in row order
+    def unique_documents():
+        for record_no, (doc_id, text, court, date) in enumerate(read_dataset(in_dir), 1):
+            # avoid possibility of duplicate document IDs in dataset; first copy is kept
+            if doc_id in doc_rows:
+                duplicates.append((doc_id, doc_rows[doc_id], record_no))
+                continue
+            doc_rows[doc_id] = len(docs)
+            # save docId to list; order of reading docIds represents order of docIds in matrix
+            docs.append(doc_id)
+            sort_keys.append((court, date))
+            yield text
+
+    # every structure is written to a scratch file next to the postings file, then packed into the segment
+    files = scratch_files(out_postings)
+    remove_scratch_files(files)
+    # collects positions and term counts of every word, in a single tokenizing pass
+    inverter = Inverter() if memory_budget is None else SpimiInverter(memory_budget, scratch_path(out_postings, ""))
+
     # read dataset
     print("processing dataset...")
-    with open(in_dir) as dataset:
-        csv.field_size_limit(sys.maxsize)
-        dataset_reader = csv.reader(dataset, delimiter=",")
-        column_no = 1
-        next(dataset) # skip header line
-        for line in dataset_reader:
-            print("\treading line", column_no); column_no += 1
-            doc_id = line[0]
-            title = line[1]
-            date = line[3] # discard; dates are most likely included in text already
-            court = line[4]
-            text = title + " " + court + " " + line[2] # add title and court to main text
+    if workers > 1:
+        invert_parallel(unique_documents(), workers, inverter)
+    else:
+        for row, text in enumerate(unique_documents()):
+            # automatically stems and case-folds each word, and stores its positions and counts
+            # row this document occupies in matrix is its position in docs
+            inverter.add_document(row, text)
 
-            # avoid possibility of duplicate document IDs in dataset
-            if doc_id not in docs:
-                # count position(s) of each word in text
-                position_count = 0
-                # automatically stems and case-folds each word
-                for word in vectorizer.build_analyzer()(text):
-                    # store word and positions in respective dictionary
-                    if word not in positions:
-                        positions[word] = {}
-                    if doc_id not in positions[word]:
-                        positions[word][doc_id] = []
-                    positions[word][doc_id].append(position_count)
-                    position_count += 1
-
-                # save docId to list; order of reading docIds represents order of docIds in matrix
-                docs.append(doc_id)
-                # save text; to be converted to term-doc matrix
-                corpus.append(text)
-        dataset.close()
+    # write positional index; with a memory budget, this is where blocks are merged
+    print("writing positional index...")
+    with PositionalIndexWriter(files['positions'], codec=codec) as posn_writer:
+        terms, counts = inverter.finish(posn_writer)
+    # rank of every row's document in read order; rows are in read order unless reordered
+    ranks = None
+    if reorder:
+        print("reordering documents...")
+        order = reorder_rows(sort_keys, counts, files['positions'])
+        counts = counts[order]
+        docs = [docs[row] for row in order.tolist()]
+        ranks = order
+        # the duplicates report gives the row the first copy ended up in
+        new_rows = np.argsort(order)
+        duplicates = [(doc_id, int(new_rows[row]), record_no) for doc_id, row, record_no in duplicates]
+    if ngram_min_df is not None:
+        print("writing n-gram index...")
+        report_ngrams(build_ngram_index(files['positions'], files['ngrams'], ngram_min_df), files)
 
     print("building vector space matrix...")
-    # construct term-document vector space matrix
+    # construct term-document vector space matrix from term counts collected above
     # each document is a row, each unique term is a column
-    matrix = (vectorizer.fit_transform(corpus))
+    matrix = vectorizer.fit_counts(terms, counts, lazy_idf)
 
     # save structures to pickle
     print("saving to disk...")
-    with gzip.open(out_postings, 'wb') as post_file:
-        pickle.dump(matrix, post_file, protocol=pickle.HIGHEST_PROTOCOL)
-    with gzip.open(out_dict, 'wb') as dict_file:
-        pickle.dump(vectorizer, dict_file, protocol=pickle.HIGHEST_PROTOCOL)
-    with gzip.open('docs.txt', 'wb') as doc_file:
-        pickle.dump(docs, doc_file, protocol=pickle.HIGHEST_PROTOCOL)
-    with gzip.open('positions.txt', 'wb') as posn_file:
-        pickle.dump(positions, posn_file, protocol=pickle.HIGHEST_PROTOCOL)
+    save_index(files, vectorizer, matrix, DocMap(DocMap.from_ids(docs).ids, ranks=ranks), quantization)
+    report_duplicates(duplicates, out_postings)
+    save_synonym_table(vectorizer, files['synonyms'])
+    # stem cache is saved so search uses the same stemmer, and can look up stems of common words
+    analysis.stem_cache.save(files['stems'])
+    # a fresh index has no deleted documents
+    save_tombstones([], files['tombstones'])
+    save_segment(out_dict, out_postings, files)
 
+    print("stem cache hit rate:", str(round(100 * analysis.stem_cache.hit_rate(), 2)) + "%,",
+          len(analysis.stem_cache.stems), "words cached")
     print("done.")
 
-input_directory = output_file_dictionary = output_file_postings = None
+# assign rows by (court, date) of their documents, in read order among equal keys, so documents
+# that share terms get nearby rows: row gaps in postings get smaller (fewer varint bytes),
+# and scoring a column reads fewer distinct parts of the accumulator
+# rewrites the positional index at positions_path in the new row order, reports the size of it and
+# of the matrix's postings before and after, and returns the old row of every new row
+# search breaks ties by read order (the ranks of the doc map), so results are the same as without
+def reorder_rows(sort_keys, counts, positions_path):
+    # sorted is stable, so documents with equal keys keep their read order
+    order = np.array(sorted(range(len(sort_keys)), key=sort_keys.__getitem__), dtype=np.int64)
+    new_rows = np.empty(len(order), dtype=np.int64)
+    new_rows[order] = np.arange(len(order))
 
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
+    temp_path = os.path.join(os.path.dirname(positions_path), "temp-" + os.path.basename(positions_path))
+    positions_size = os.path.getsize(positions_path)
+    positions = PositionalIndex.open(positions_path)
+    with PositionalIndexWriter(temp_path, codec=positions.codec) as posn_writer:
+        remap_rows(positions, posn_writer, new_rows)
+    os.replace(temp_path, positions_path)
+    print("positional index:", positions_size, "->", os.path.getsize(positions_path), "bytes;",
+          "matrix row gaps:", row_gap_bytes(counts), "->", row_gap_bytes(counts[order]), "bytes")
+    return order
 
-for o, a in opts:
-    if o == '-i':  # input directory
-        input_directory = a
-    elif o == '-d':  # dictionary file
-        output_file_dictionary = a
-    elif o == '-p':  # postings file
-        output_file_postings = a
-    else:
-        assert False, "unhandled option"
+# size of the row gaps of every column of matrix as varints, i.e. of the row part of its postings
+def row_gap_bytes(matrix):
+    columns = matrix.tocsc()
+    columns.sort_indices()
+    # gaps restart at the first row of every column
+    starts = columns.indptr[:-1][np.diff(columns.indptr) > 0]
+    gaps = np.diff(columns.indices, prepend=0)
+    gaps[starts] = columns.indices[starts]
+    return len(varint_encode(gaps))
+
+# write duplicate records (skipped while indexing) next to the index, named after it (e.g. postings.txt.duplicates)
+def report_duplicates(duplicates, out_postings):
+    if not duplicates:
+        return
+    report_path = out_postings + ".duplicates"
+    print(len(duplicates), "duplicate records skipped; see", report_path)
+    with open(report_path, 'w') as dup_file:
+        dup_file.write("doc_id,kept_row,duplicate_record\n")
+        for doc_id, row, record_no in duplicates:
+            dup_file.write(doc_id + "," + str(row) + "," + str(record_no) + "\n")
+
+# number of n-grams kept, and size of n-gram index next to positional index
+def report_ngrams(kept, files):
+    ngrams_size, positions_size = os.path.getsize(files['ngrams']), os.path.getsize(files['positions'])
+    print("n-gram index:", kept[2], "biwords,", kept[3], "triwords,", ngrams_size, "bytes",
+          "(" + str(round(100 * ngrams_size / positions_size, 1)) + "% of positional index)")
+
+# one WordNet synonym per term, so search can expand queries with a table lookup instead of loading WordNet
+# the words are those seen while indexing, i.e. the stem cache (after an update, the saved words and the delta's)
+def save_synonym_table(vectorizer, path):
+    print("building synonym table...")
+    vocabulary = vectorizer.vocabulary_
+    try:
+        synonyms = build_synonyms(analysis.stem_cache.all_stems(), lambda term: vocabulary.get(term, -1), len(vocabulary))
+    except LookupError:
+        # the segment gets no synonyms section; a table of a previous build would no longer match the vocabulary
+        print("WordNet data not found; synonyms will be looked up in WordNet at search time")
+        return
+    save_synonyms(synonyms, path)
+    print(np.count_nonzero(synonyms != -1), "of", len(synonyms), "terms have a synonym")
 
-if input_directory == None or output_file_postings == None or output_file_dictionary == None:
-    usage()
+def save_index(files, vectorizer, matrix, docs, quantization=None):
+    vectorizer.save_vocabulary(files['vocabulary'], matrix)
+    if quantization is not None:
+        matrix, scales = quantize(matrix, quantization)
+        if scales is not None:
+            save_scales(scales, files['scales'])
+    save_matrix(matrix, files['matrix'])
+    # CSC copy of the matrix, so search can score a query from the columns of its terms only,
+    # and the largest weight in every column, for top-k scoring with MaxScore pruning
+    columns = csc_copy(matrix)
+    save_matrix(columns, files['columns'])
+    save_max_impacts(columns, files['impacts'])
+    docs.save(files['docmap'])
+
+# an index is a single segment file (segment.py) at the postings path; its structures are written to
+# scratch files named after it (e.g. temp-postings.txt.positions) first, so nothing is written to fixed
+# file names and several indexes can be kept side by side
+def scratch_path(out_postings, suffix):
+    return os.path.join(os.path.dirname(out_postings), "temp-" + os.path.basename(out_postings) + "." + suffix)
+
+def scratch_files(out_postings):
+    return {name: scratch_path(out_postings, name) for name in SECTIONS}
+
+def remove_scratch_files(files):
+    for path in files.values():
+        if os.path.exists(path):
+            os.remove(path)
+
+# pack scratch files into the segment at out_postings, then remove them; sections in keep that were
+# not rewritten are copied over from segment, the index's previous segment
+# the dictionary file becomes a json manifest of the segment, for people and tools; search only reads the segment
+def save_segment(out_dict, out_postings, files, segment=None, keep=()):
+    sections = []
+    for name in SECTIONS:
+        if os.path.exists(files[name]):
+            sections.append((name, files[name]))
+        elif name in keep and segment is not None and name in segment:
+            sections.append((name, segment.section(name)))
+    write_segment(out_postings, sections)
+    remove_scratch_files(files)
+
+    segment = Segment.open(out_postings)
+    manifest = {"segment": os.path.relpath(os.path.abspath(out_postings), os.path.dirname(os.path.abspath(out_dict))),
+                "version": SEGMENT_VERSION,
+                "sections": {name: {"offset": offset, "length": length, "crc32": checksum}
+                             for name, (offset, length, checksum) in segment.sections.items()}}
+    with open(out_dict, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+# load an existing index for updating; only indexes built with --lazy-idf can be updated in place
+def load_index(out_dict, out_postings):
+    try:
+        segment = Segment.open(out_postings)
+    except ValueError:
+        print("index was built by an older version of index.py; rebuild it with --lazy-idf to update it incrementally")
+        sys.exit(2)
+    matrix = matrix_from_buffer(segment.section('matrix'))
+    # quantized weights are updated as float32, and quantized again when saved
+    if index_quantization(segment) is not None:
+        matrix = dequantize(matrix, scales_from_buffer(segment.section('scales')) if 'scales' in segment else None)
+    vocabulary = Vocabulary(segment.section('vocabulary'))
+    docs = DocMap.from_buffer(segment.section('docmap'))
+    if vocabulary.config["lazy_idf"]:
+        # words must be stemmed the same way as when index was built
+        analysis.set_stem_cache(StemCache.from_buffer(segment.section('stems')))
+        return TfidfStemVectorizer.from_vocabulary(vocabulary), matrix, docs, segment
+    print("index was built without --lazy-idf; rebuild it with --lazy-idf to update it incrementally")
     sys.exit(2)
 
-build_index(input_directory, output_file_dictionary, output_file_postings)
+# quantization of the weights of an index segment (see quantize.py), or None
+def index_quantization(segment):
+    dtype = matrix_from_buffer(segment.section('matrix')).dtype.name
+    return dtype if dtype in QUANTIZATIONS else None
+
+# tombstones: rows of deleted (or replaced) documents, filtered out by search until the index is compacted
+def load_tombstones(segment):
+    return tombstones_from_buffer(segment.section('tombstones')).tolist()
+
+# rebuild the n-gram index of segment from the positional index in files, keeping its threshold
+def update_ngrams(segment, files, deleted=()):
+    min_doc_freq = PositionalIndex(segment.section('ngrams')).min_doc_freq
+    report_ngrams(build_ngram_index(files['positions'], files['ngrams'], min_doc_freq, deleted), files)
+
+# mark rows as deleted; terms of deleted rows no longer count towards document frequencies
+def delete_rows(vectorizer, matrix, tombstones, rows):
+    for row in rows:
+        if row not in tombstones:
+            tombstones.add(row)
+            vectorizer.doc_freqs_[matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]] -= 1
+            vectorizer.n_docs_ -= 1
+
+# append documents of a delta dataset to an existing index without refitting it
+# new terms are added to the vocabulary, new rows to the matrix and positional index;
+# a document already in the index is replaced: its old row is tombstoned
+def update_index(in_file, out_dict, out_postings):
+    vectorizer, matrix, docs, segment = load_index(out_dict, out_postings)
+    files = scratch_files(out_postings)
+    remove_scratch_files(files)
+    tombstones = set(load_tombstones(segment))
+    # rows of documents added by this update
+    new_rows = {}
+    new_ids = []
+    replaced = []
+    first_row = len(docs)
+    inverter = Inverter()
+
+    print("processing delta dataset...")
+    for doc_id, text, _, _ in read_dataset(in_file):
+        row = new_rows[doc_id] if doc_id in new_rows else docs.row(doc_id)
+        if row != -1 and row not in tombstones:
+            replaced.append(row)
+        new_rows[doc_id] = first_row + len(new_ids)
+        inverter.add_document(new_rows[doc_id], text)
+        new_ids.append(doc_id)
+    # new documents are read after every document already in the index
+    new_ranks = docs.ranks.max(initial=-1) + 1 + np.arange(len(new_ids), dtype=np.int64)
+    docs = DocMap(np.concatenate((docs.ids, DocMap.from_ids(new_ids).ids)),
+                  ranks=np.concatenate((docs.ranks, new_ranks)))
+
+    # merge postings of new documents into positional index; their rows come after all existing rows
+    print("updating positional index...")
+    update_block = scratch_path(out_postings, "update")
+    with PositionalIndexWriter(update_block) as block_writer:
+        new_terms, new_counts = inverter.finish(block_writer)
+    positions = PositionalIndex(segment.section('positions'))
+    with PositionalIndexWriter(files['positions'], codec=positions.codec) as posn_writer:
+        merge_indexes([positions, PositionalIndex.open(update_block)], posn_writer, len(docs))
+    os.remove(update_block)
+
+    # append rows for new documents, with new terms getting new columns at the end of the vocabulary
+    print("updating vector space matrix...")
+    columns = vectorizer.extend_vocabulary(new_terms)
+    new_counts = new_counts[first_row:]
+    new_counts = sparse.csr_matrix((new_counts.data, columns[new_counts.indices], new_counts.indptr),
+                                   shape=(new_counts.shape[0], len(vectorizer.vocabulary_)))
+    new_counts.sort_indices()
+    # widen existing rows to new vocabulary size; arrays are shared, not copied
+    matrix = sparse.csr_matrix((matrix.data, matrix.indices, matrix.indptr),
+                               shape=(matrix.shape[0], len(vectorizer.vocabulary_)), copy=False)
+    matrix = sparse.vstack([matrix, vectorizer.doc_weights(new_counts)], format='csr')
+    vectorizer.doc_freqs_ += np.bincount(new_counts.indices, minlength=len(vectorizer.vocabulary_))
+    vectorizer.n_docs_ += new_counts.shape[0]
+    delete_rows(vectorizer, matrix, tombstones, replaced)
+    vectorizer.refresh_idf()
+    if 'ngrams' in segment:
+        print("updating n-gram index...")
+        update_ngrams(segment, files, tombstones)
+    # new terms need synonyms too
+    save_synonym_table(vectorizer, files['synonyms'])
+
+    print("saving to disk...")
+    save_index(files, vectorizer, matrix, docs, index_quantization(segment))
+    save_tombstones(tombstones, files['tombstones'])
+    # words of the delta are added to the stem cache, for the synonyms of later updates and for search
+    analysis.stem_cache.save(files['stems'])
+    save_segment(out_dict, out_postings, files, segment)
+    print(new_counts.shape[0], "documents added,", len(replaced), "replaced.")
+    print("done.")
+
+# tombstone documents listed (one docId per line) in ids_file
+def delete_documents(ids_file, out_dict, out_postings):
+    vectorizer, matrix, docs, segment = load_index(out_dict, out_postings)
+    files = scratch_files(out_postings)
+    remove_scratch_files(files)
+    tombstones = set(load_tombstones(segment))
+    with open(ids_file) as id_file:
+        doc_ids = [line.strip() for line in id_file if line.strip()]
+    rows = [row for row in docs.rows(DocMap.from_ids(doc_ids).ids).tolist() if row != -1 and row not in tombstones]
+    delete_rows(vectorizer, matrix, tombstones, rows)
+    vectorizer.refresh_idf()
+
+    # only the vocabulary (document frequencies) and tombstones change
+    vectorizer.save_vocabulary(files['vocabulary'], matrix)
+    save_tombstones(tombstones, files['tombstones'])
+    save_segment(out_dict, out_postings, files, segment, keep=SECTIONS)
+    print(len(rows), "documents deleted,", len(doc_ids) - len(rows), "not found.")
+
+# rewrite index without tombstoned rows; remaining rows are renumbered in their existing order
+def compact_index(out_dict, out_postings):
+    vectorizer, matrix, docs, segment = load_index(out_dict, out_postings)
+    files = scratch_files(out_postings)
+    remove_scratch_files(files)
+    tombstones = load_tombstones(segment)
+    live_rows = np.setdiff1d(np.arange(len(docs)), np.array(tombstones, dtype=np.int64))
+    new_rows = np.full(len(docs), -1, dtype=np.int64)
+    new_rows[live_rows] = np.arange(len(live_rows))
+
+    print("compacting positional index...")
+    positions = PositionalIndex(segment.section('positions'))
+    with PositionalIndexWriter(files['positions'], codec=positions.codec) as posn_writer:
+        remap_rows(positions, posn_writer, new_rows)
+    if 'ngrams' in segment:
+        print("compacting n-gram index...")
+        update_ngrams(segment, files)
+
+    print("compacting vector space matrix...")
+    matrix = matrix[live_rows]
+    docs = DocMap(docs.ids[live_rows], ranks=docs.ranks[live_rows])
+    vectorizer.doc_freqs_ = np.bincount(matrix.indices, minlength=len(vectorizer.vocabulary_)).astype(np.int64)
+    vectorizer.n_docs_ = len(docs)
+    vectorizer.refresh_idf()
+
+    print("saving to disk...")
+    save_index(files, vectorizer, matrix, docs, index_quantization(segment))
+    save_tombstones([], files['tombstones'])
+    # vocabulary columns are unchanged, so synonyms still match
+    save_segment(out_dict, out_postings, files, segment, keep=('stems', 'synonyms'))
+    print(len(tombstones), "deleted documents removed.")
+    print("done.")
+
+# guard needed so worker processes can import this module without re-running the indexer
+if __name__ == '__main__':
+    input_directory = output_file_dictionary = output_file_postings = None
+    update_file = delete_file = None
+    compact = False
+    workers = 1
+    memory_budget = None
+    stem_backend = "snowball"
+    lazy_idf = False
+    ngram_min_df = None
+    quantization = None
+    reorder = False
+    codec = "varint"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:j:u:', ['memory-budget=', 'stemmer=', 'lazy-idf',
+                                                                 'delete=', 'compact', 'ngrams=',
+                                                                 'quantize=', 'reorder', 'codec='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-i':  # input directory
+            input_directory = a
+        elif o == '-d':  # dictionary file
+            output_file_dictionary = a
+        elif o == '-p':  # postings file
+            output_file_postings = a
+        elif o == '-j':  # number of worker processes
+            workers = int(a)
+        elif o == '--memory-budget':  # approximate memory for in-memory postings, in megabytes
+            memory_budget = int(float(a) * 1024 * 1024)
+        elif o == '--stemmer':  # stemming backend
+            stem_backend = a
+        elif o == '--lazy-idf':  # keep idf out of matrix, so index can be updated
+            lazy_idf = True
+        elif o == '-u':  # delta dataset file to add to existing index
+            update_file = a
+        elif o == '--delete':  # file of docIds to delete from existing index
+            delete_file = a
+        elif o == '--compact':  # rewrite existing index without deleted documents
+            compact = True
+        elif o == '--ngrams':  # build n-gram index of word pairs/triples in at least this many documents
+            ngram_min_df = int(a)
+        elif o == '--quantize':  # store document weights quantized to this type
+            if a not in QUANTIZATIONS:
+                usage()
+                sys.exit(2)
+            quantization = a
+        elif o == '--reorder':  # assign rows by court and date, for smaller postings
+            reorder = True
+        elif o == '--codec':  # integer encoding of positional and n-gram postings
+            if a not in CODECS:
+                usage()
+                sys.exit(2)
+            codec = a
+        else:
+            assert False, "unhandled option"
+
+    if output_file_postings == None or output_file_dictionary == None:
+        usage()
+        sys.exit(2)
+    # the n-gram index is built from the whole corpus' token sequence in memory, which would defeat the budget
+    if memory_budget != None and ngram_min_df != None:
+        print("--ngrams cannot be combined with --memory-budget")
+        usage()
+        sys.exit(2)
+
+    if update_file != None:
+        update_index(update_file, output_file_dictionary, output_file_postings)
+    elif delete_file != None:
+        delete_documents(delete_file, output_file_dictionary, output_file_postings)
+    elif compact:
+        compact_index(output_file_dictionary, output_file_postings)
+    elif input_directory != None:
+        analysis.set_stem_cache(StemCache(stem_backend))
+        build_index(input_directory, output_file_dictionary, output_file_postings, workers, memory_budget, lazy_idf,
+                    ngram_min_df, quantization, reorder, codec)
+    else:
+        usage()
+        sys.exit(2)
@@ -0,0 +1,194 @@
+import os
+import heapq
+import itertools
+import multiprocessing
+from array import array
+import numpy as np
+from scipy import sparse
+import analysis
+from analysis import analyze, StemCache
+from positional import PositionalIndex, PositionalIndexWriter
+
+# number of documents sent to a worker process at a time when indexing in parallel
+CHUNK_SIZE = 64
+# rough in-memory cost of a term's entry (dict slots, array headers) and of each stored integer, in bytes
+TERM_OVERHEAD = 400
+INT_SIZE = 8
+
+# single-pass inverter: every document is tokenized and stemmed exactly once,
+# and that one pass yields both the positional postings and the term counts of the tf-idf matrix
+# (a term's count in a document is just the number of positions it has there)
+class Inverter:
+    def __init__(self):
+        # per term: rows containing term, count in each row, positions in each row (concatenated)
+        self.rows = {}
+        self.counts = {}
+        self.positions = {}
+        self.n_docs = 0
+        # estimated memory held by postings, in bytes
+        self.size = 0
+
+    # invert one document; rows must be added in increasing order
+    def add_document(self, row, text):
+        doc_positions = {}
+        for position, word in enumerate(analyze(text)):
+            if word not in doc_positions:
+                doc_positions[word] = []
+            doc_positions[word].append(position)
+
+        for word, word_positions in doc_positions.items():
+            if word not in self.rows:
+                self.rows[word] = array('q')
+                self.counts[word] = array('q')
+                self.positions[word] = array('q')
+                self.size += TERM_OVERHEAD
+            self.rows[word].append(row)
+            self.counts[word].append(len(word_positions))
+            self.positions[word].extend(word_positions)
+            self.size += INT_SIZE * (2 + len(word_positions))
+        self.n_docs = max(self.n_docs, row + 1)
+
+    # append postings of another inverter whose rows all come after the rows of this one
+    # (i.e. a later row range of the same dataset), giving the same result as inverting both ranges here
+    def merge(self, other):
+        for word in other.rows:
+            if word not in self.rows:
+                self.rows[word] = other.rows[word]
+                self.counts[word] = other.counts[word]
+                self.positions[word] = other.positions[word]
+            else:
+                self.rows[word].extend(other.rows[word])
+                self.counts[word].extend(other.counts[word])
+                self.positions[word].extend(other.positions[word])
+        self.n_docs = max(self.n_docs, other.n_docs)
+        self.size += other.size
+
+    # write positional postings in sorted term order, and return vocabulary (in column order)
+    # with the (n_docs x n_terms) term-count matrix
+    def finish(self, writer):
+        terms = sorted(self.rows)
+        for term in terms:
+            writer.add(term, self.rows[term], self.counts[term], self.positions[term])
+        doc_freqs = [len(self.rows[term]) for term in terms]
+        rows = np.concatenate([np.frombuffer(self.rows[term], dtype=np.int64) for term in terms]) \
+            if terms else np.empty(0, dtype=np.int64)
+        counts = np.concatenate([np.frombuffer(self.counts[term], dtype=np.int64) for term in terms]) \
+            if terms else np.empty(0, dtype=np.int64)
+        return terms, count_matrix(doc_freqs, rows, counts, self.n_docs)
+
+# SPIMI-style inverter for bounded-memory builds
+# whenever the estimated size of the in-memory postings passes memory_budget bytes, they are
+# written out in sorted term order to a temporary block file and memory is freed;
+# finish() then k-way merges all blocks into the final positional index and count matrix
+class SpimiInverter(Inverter):
+    def __init__(self, memory_budget, temp_prefix="temp-"):
+        super().__init__()
+        self.memory_budget = memory_budget
+        self.temp_prefix = temp_prefix
+        self.block_paths = []
+
+    def add_document(self, row, text):
+        super().add_document(row, text)
+        if self.size >= self.memory_budget:
+            self.write_block()
+
+    def merge(self, other):
+        super().merge(other)
+        if self.size >= self.memory_budget:
+            self.write_block()
+
+    # dump in-memory postings to a block file; blocks use the positional index format, so they
+    # are sorted by term and can be read back lazily with mmap during the merge
+    def write_block(self):
+        block_path = self.temp_prefix + str(len(self.block_paths) + 1) + ".blk"
+        print("\twriting block", block_path)
+        with PositionalIndexWriter(block_path) as writer:
+            for term in sorted(self.rows):
+                writer.add(term, self.rows[term], self.counts[term], self.positions[term])
+        self.block_paths.append(block_path)
+        self.rows = {}
+        self.counts = {}
+        self.positions = {}
+        self.size = 0
+
+    def finish(self, writer):
+        if self.rows or not self.block_paths:
+            self.write_block()
+        print("merging", len(self.block_paths), "blocks...")
+        result = merge_blocks(self.block_paths, writer, self.n_docs)
+        for block_path in self.block_paths:
+            os.remove(block_path)
+        self.block_paths = []
+        return result
+
+# build (n_docs x n_terms) term-count matrix from postings concatenated in column order
+def count_matrix(doc_freqs, rows, counts, n_docs):
+    indptr = np.zeros(len(doc_freqs) + 1, dtype=np.int64)
+    np.cumsum(doc_freqs, out=indptr[1:])
+    matrix = sparse.csc_matrix((counts, rows, indptr), shape=(n_docs, len(doc_freqs)))
+    # CSR with sorted column indices in every row
+    return matrix.tocsr()
+
+# (term, block number) pairs of a block, in sorted term order
+def block_terms(block, block_no):
+    return ((term, block_no) for term in block.terms)
+
+# n-way merge of sorted block files into writer
+# blocks hold consecutive row ranges, so a term's postings are joined by concatenating them in block order
+def merge_blocks(block_paths, writer, n_docs):
+    return merge_indexes([PositionalIndex.open(block_path) for block_path in block_paths], writer, n_docs)
+
+# same, for positional indexes that are already open (e.g. the positional index section of a segment)
+def merge_indexes(blocks, writer, n_docs):
+    terms = []
+    doc_freqs = array('q')
+    all_rows = array('q')
+    all_counts = array('q')
+    merged_terms = heapq.merge(*[block_terms(block, block_no) for block_no, block in enumerate(blocks)])
+    for term, group in itertools.groupby(merged_terms, key=lambda item: item[0]):
+        postings = [blocks[block_no].postings(term) for _, block_no in group]
+        rows = np.concatenate([block_rows for block_rows, _, _ in postings])
+        counts = np.concatenate([block_counts for _, block_counts, _ in postings])
+        writer.add(term, rows, counts, np.concatenate([block_positions for _, _, block_positions in postings]))
+        terms.append(term)
+        doc_freqs.append(len(rows))
+        all_rows.extend(rows.tolist())
+        all_counts.extend(counts.tolist())
+    return terms, count_matrix(doc_freqs, np.frombuffer(all_rows, dtype=np.int64),
+                               np.frombuffer(all_counts, dtype=np.int64), n_docs)
+
+# split stream of document texts into (first row, [texts]) row ranges
+def chunk_documents(texts, chunk_size):
+    chunk = []
+    start_row = 0
+    for text in texts:
+        chunk.append(text)
+        if len(chunk) == chunk_size:
+            yield (start_row, chunk)
+            start_row += len(chunk)
+            chunk = []
+    if chunk:
+        yield (start_row, chunk)
+
+# give worker process a stem cache using the same stemmer as the parent
+def init_worker(stem_backend):
+    analysis.set_stem_cache(StemCache(stem_backend))
+
+# invert one row range; runs in a worker process
+# also returns words the worker's stem cache learnt, so the parent can keep one cache for the whole build
+def invert_chunk(chunk):
+    start_row, texts = chunk
+    inverter = Inverter()
+    for i, text in enumerate(texts):
+        inverter.add_document(start_row + i, text)
+    return inverter, analysis.stem_cache.drain()
+
+# tokenize, stem and invert documents in a pool of worker processes
+# partial inverters come back in row order and are merged into inverter as they arrive, so the result is
+# identical to inverting every document in this process
+def invert_parallel(texts, workers, inverter, chunk_size=CHUNK_SIZE):
+    with multiprocessing.Pool(workers, init_worker, (analysis.stem_cache.backend,)) as pool:
+        for partial, stem_delta in pool.imap(invert_chunk, chunk_documents(texts, chunk_size)):
+            inverter.merge(partial)
+            analysis.stem_cache.absorb(stem_delta)
+    return inverter
@@ -0,0 +1,62 @@
+import os
+import struct
+import numpy as np
+from scipy import sparse
+
+#### MATRIX FORMAT (single file, little-endian, uncompressed)
+# header: magic, format version, layout (0 = CSR, 1 = CSC), shape, number of stored values,
+#         dtypes of data and index arrays, byte offsets of data, indices and indptr arrays
+# arrays follow the header, each starting on a 64-byte boundary
+#
+# arrays are wrapped straight from the mapped file, so opening the matrix only reads the header;
+# pages of the arrays are read from disk when scoring touches them
+
+MAGIC = b"TFMATRIX"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQ8s8sQQQ")
+ALIGNMENT = 64
+LAYOUTS = {"csr": 0, "csc": 1}
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+# write a CSR or CSC matrix; index arrays are stored as int32 when they fit, which is what scipy
+# would convert them to anyway (keeping them int64 would make scipy copy them on load)
+# written to a temp file first, as the matrix may be mapped from the file being replaced
+def save_matrix(matrix, path):
+    layout = matrix.format
+    if layout not in LAYOUTS:
+        matrix = matrix.tocsr()
+        layout = "csr"
+    index_dtype = np.dtype("<i4") if max(matrix.nnz, max(matrix.shape)) < 2 ** 31 else np.dtype("<i8")
+    data = np.ascontiguousarray(matrix.data, dtype=matrix.data.dtype.newbyteorder("<"))
+    indices = np.ascontiguousarray(matrix.indices, dtype=index_dtype)
+    indptr = np.ascontiguousarray(matrix.indptr, dtype=index_dtype)
+
+    data_offset = align(HEADER.size)
+    indices_offset = align(data_offset + data.nbytes)
+    indptr_offset = align(indices_offset + indices.nbytes)
+    temp_path = os.path.join(os.path.dirname(path), "temp-" + os.path.basename(path))
+    with open(temp_path, "wb") as matrix_file:
+        matrix_file.write(HEADER.pack(MAGIC, VERSION, LAYOUTS[layout], matrix.shape[0], matrix.shape[1], matrix.nnz,
+                                      data.dtype.str.encode(), index_dtype.str.encode(),
+                                      data_offset, indices_offset, indptr_offset))
+        for offset, array in ((data_offset, data), (indices_offset, indices), (indptr_offset, indptr)):
+            matrix_file.write(b"\0" * (offset - matrix_file.tell()))
+            matrix_file.write(array.tobytes())
+    os.replace(temp_path, path)
+
+# wrap matrix stored in buffer without copying its arrays
+def matrix_from_buffer(buffer):
+    (magic, version, layout, n_rows, n_cols, nnz, data_dtype, index_dtype,
+     data_offset, indices_offset, indptr_offset) = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a matrix file (or unsupported version)")
+    data_dtype = np.dtype(data_dtype.rstrip(b"\0").decode())
+    index_dtype = np.dtype(index_dtype.rstrip(b"\0").decode())
+    data = np.frombuffer(buffer, dtype=data_dtype, count=nnz, offset=data_offset)
+    indices = np.frombuffer(buffer, dtype=index_dtype, count=nnz, offset=indices_offset)
+    n_pointers = (n_rows if layout == LAYOUTS["csr"] else n_cols) + 1
+    indptr = np.frombuffer(buffer, dtype=index_dtype, count=n_pointers, offset=indptr_offset)
+    matrix_type = sparse.csr_matrix if layout == LAYOUTS["csr"] else sparse.csc_matrix
+    return matrix_type((data, indices, indptr), shape=(n_rows, n_cols), copy=False)
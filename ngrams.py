@@ -0,0 +1,70 @@
+import numpy as np
+from positional import PositionalIndex, PositionalIndexWriter
+
+# n-gram (biword and triword) postings, so a 2-3 word phrase is found with a single postings lookup
+# n-grams are consecutive analyzed words joined by a space, e.g. "high court"; analyzed words never
+# contain spaces. only n-grams in at least min_doc_freq documents are kept, to bound the size of the
+# index; phrases missing from it are matched with the positional index instead
+# the n-gram index is written in the positional index format, positions being where each n-gram starts
+
+NGRAM_SIZES = (2, 3)
+
+# every token of the positional index as (row, position, term id) arrays, in document order
+# rows in deleted are left out
+def token_sequence(positions, deleted=()):
+    rows, token_positions, term_ids = [], [], []
+    for term_id, term in enumerate(positions.terms):
+        term_rows, counts, term_positions = positions.postings(term)
+        rows.append(np.repeat(term_rows, counts))
+        token_positions.append(term_positions)
+        term_ids.append(np.full(len(term_positions), term_id, dtype=np.int64))
+    if not rows:
+        return (np.empty(0, dtype=np.int64),) * 3
+    rows, token_positions, term_ids = np.concatenate(rows), np.concatenate(token_positions), np.concatenate(term_ids)
+    if deleted:
+        live = ~np.isin(rows, list(deleted))
+        rows, token_positions, term_ids = rows[live], token_positions[live], term_ids[live]
+    order = np.lexsort((token_positions, rows))
+    return rows[order], token_positions[order], term_ids[order]
+
+# build n-gram index at path from the positional index at positions_path, with the same codec
+# returns the number of n-grams kept of each size
+def build_ngram_index(positions_path, path, min_doc_freq, deleted=()):
+    positions = PositionalIndex.open(positions_path)
+    terms = positions.terms
+    rows, token_positions, term_ids = token_sequence(positions, deleted)
+
+    # (n-gram string, rows, positions) of every n-gram kept
+    ngrams = []
+    kept = {}
+    for n in NGRAM_SIZES:
+        # starts of n consecutive tokens within one document
+        starts = np.arange(max(len(rows) - n + 1, 0))
+        ends = starts + n - 1
+        consecutive = (rows[ends] == rows[starts]) & (token_positions[ends] == token_positions[starts] + n - 1)
+        starts = starts[consecutive]
+        grams = np.stack([term_ids[starts + i] for i in range(n)], axis=1)
+        # document frequency of every distinct n-gram: distinct (n-gram, row) pairs per n-gram
+        unique_grams, gram_ids = np.unique(grams, axis=0, return_inverse=True)
+        gram_ids = gram_ids.ravel()
+        doc_freqs = np.bincount(np.unique(np.stack((gram_ids, rows[starts]), axis=1), axis=0)[:, 0],
+                                minlength=len(unique_grams))
+        keep = np.flatnonzero(doc_freqs >= min_doc_freq)
+        kept[n] = len(keep)
+
+        # occurrences of kept n-grams, grouped by n-gram, in (row, position) order within a group
+        occurrences = np.flatnonzero(np.isin(gram_ids, keep))
+        occurrences = occurrences[np.lexsort((token_positions[starts[occurrences]], rows[starts[occurrences]],
+                                              gram_ids[occurrences]))]
+        bounds = np.searchsorted(gram_ids[occurrences], keep, side="left").tolist() + [len(occurrences)]
+        for i, gram_id in enumerate(keep.tolist()):
+            group = starts[occurrences[bounds[i]:bounds[i + 1]]]
+            ngrams.append((" ".join(terms[term_id] for term_id in unique_grams[gram_id].tolist()),
+                           rows[group], token_positions[group]))
+
+    ngrams.sort(key=lambda ngram: ngram[0])
+    with PositionalIndexWriter(path, min_doc_freq, positions.codec) as ngram_writer:
+        for ngram, ngram_rows, ngram_positions in ngrams:
+            doc_rows, counts = np.unique(ngram_rows, return_counts=True)
+            ngram_writer.add(ngram, doc_rows, counts, ngram_positions)
+    return kept
@@ -0,0 +1,293 @@
+import mmap
+import struct
+import bisect
+import numpy as np
+from codec import CODECS, ENCODERS, DECODERS, varint_decode
+from vocabulary import TermList
+
+#### POSITIONAL INDEX FORMAT (single file, little-endian)
+# header: magic, format version, minimum document frequency, number of terms, offset of term table,
+#   codec, number of documents per block
+#   terms with a lower document frequency were left out of the index (0: every term is in it)
+#   codec: index into codec.CODECS of how the integers of blocks are encoded (varints or PFOR)
+# postings: the postings of every term, in sorted term order
+#   skip table, only for terms in more than one block: last row int64[n_blocks], and end offset
+#     int64[n_blocks] of every block, relative to the end of the skip table
+#   blocks of up to BLOCK_SIZE documents: [row gaps x n][counts x n][position gaps x sum(counts)],
+#   encoded as two arrays (row gaps and counts, then position gaps)
+#   row gaps are relative to the previous row (the last row of the previous block for a block's
+#   first row); position gaps restart at 0 for every document. a block only depends on the last row
+#   of the block before it, so looking rows up decodes just the blocks the skip table says they can be in
+# term table (at end of file, so postings can be streamed out while indexing):
+#   block offsets int64[n_terms + 1], doc frequencies int64[n_terms],
+#   term offsets int64[n_terms + 1], utf-8 term blob
+#
+# rows are matrix row numbers (i.e. indices into the docs list), not document IDs
+
+MAGIC = b"POSIDX\0\0"
+VERSION = 2
+HEADER = struct.Struct("<8sIIQQII")
+# version 1 files have neither codec nor blocks: every term is a single varint block without a skip table
+HEADER_V1 = struct.Struct("<8sIIQQ")
+BLOCK_SIZE = 128
+
+# streams a positional index to disk one term at a time
+# terms must be added in sorted order so search can binary-search the term table
+# min_doc_freq is recorded in the header if terms below a document frequency are being left out
+# codec is one of codec.CODECS
+class PositionalIndexWriter:
+    def __init__(self, path, min_doc_freq=0, codec="varint"):
+        if codec not in CODECS:
+            raise ValueError("unknown codec: " + codec)
+        self.min_doc_freq = min_doc_freq
+        self.codec = codec
+        self.file = open(path, "wb")
+        self.file.write(b"\0" * HEADER.size)
+        self.terms = []
+        self.block_offsets = [HEADER.size]
+        self.doc_freqs = []
+
+    # rows: sorted row numbers containing term; counts: number of positions in each row
+    # positions: positions of term in each row, concatenated in row order
+    def add(self, term, rows, counts, positions):
+        if self.terms and term <= self.terms[-1]:
+            raise ValueError("terms must be added in sorted order: " + repr(term))
+        rows = np.asarray(rows, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+
+        # restart position gaps at the first position of every document
+        position_gaps = np.diff(positions, prepend=0)
+        doc_starts = np.cumsum(counts) - counts
+        position_gaps[doc_starts] = positions[doc_starts]
+
+        encode = ENCODERS[self.codec]
+        row_gaps = np.diff(rows, prepend=0)
+        position_ends = np.cumsum(counts)
+        blocks = []
+        for start in range(0, len(rows), BLOCK_SIZE):
+            end = min(start + BLOCK_SIZE, len(rows))
+            first_position = int(position_ends[start - 1]) if start else 0
+            blocks.append(encode(np.concatenate((row_gaps[start:end], counts[start:end]))) +
+                          encode(position_gaps[first_position:int(position_ends[end - 1])]))
+        if len(blocks) > 1:
+            last_rows = rows[np.arange(BLOCK_SIZE, len(rows) + BLOCK_SIZE, BLOCK_SIZE).clip(max=len(rows)) - 1]
+            block_ends = np.cumsum([len(block) for block in blocks])
+            blocks.insert(0, last_rows.astype("<i8").tobytes() + block_ends.astype("<i8").tobytes())
+        postings = b"".join(blocks)
+        self.file.write(postings)
+        self.terms.append(term)
+        self.block_offsets.append(self.block_offsets[-1] + len(postings))
+        self.doc_freqs.append(len(rows))
+
+    # write term table and patch header
+    def close(self):
+        table_offset = self.block_offsets[-1]
+        encoded_terms = [term.encode("utf-8") for term in self.terms]
+        term_offsets = np.zeros(len(encoded_terms) + 1, dtype="<i8")
+        np.cumsum([len(term) for term in encoded_terms], out=term_offsets[1:])
+
+        self.file.write(np.asarray(self.block_offsets, dtype="<i8").tobytes())
+        self.file.write(np.asarray(self.doc_freqs, dtype="<i8").tobytes())
+        self.file.write(term_offsets.tobytes())
+        self.file.write(b"".join(encoded_terms))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.min_doc_freq, len(self.terms), table_offset,
+                                    CODECS.index(self.codec), BLOCK_SIZE))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+# read-only view of a positional index held in a buffer (normally a mmap of the index file)
+# nothing is decoded up front; a term's block is only decoded when it is looked up
+# rows in deleted (tombstones of an incrementally updated index) are left out of lookups by term
+class PositionalIndex:
+    def __init__(self, buffer, docs=None, deleted=()):
+        magic, version, min_doc_freq, n_terms, table_offset = HEADER_V1.unpack_from(buffer, 0)
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError("not a positional index file (or unsupported version)")
+        if version == 1:
+            self.codec, self.block_size = "varint", None
+        else:
+            codec, self.block_size = HEADER.unpack_from(buffer, 0)[5:]
+            self.codec = CODECS[codec]
+        self.buffer = buffer
+        self.min_doc_freq = min_doc_freq
+        self.docs = docs
+        self.deleted = deleted
+        self.n_terms = n_terms
+        offset = table_offset
+        self.block_offsets = np.frombuffer(buffer, dtype="<i8", count=n_terms + 1, offset=offset)
+        offset += 8 * (n_terms + 1)
+        self.doc_freqs = np.frombuffer(buffer, dtype="<i8", count=n_terms, offset=offset)
+        offset += 8 * n_terms
+        self.term_offsets = np.frombuffer(buffer, dtype="<i8", count=n_terms + 1, offset=offset)
+        offset += 8 * (n_terms + 1)
+        self.term_blob_offset = offset
+        self.term_list = TermList(buffer, self.term_offsets, offset)
+        self._terms = None
+
+    # map index file into memory; pages are only read from disk when touched
+    @classmethod
+    def open(cls, path, docs=None, deleted=()):
+        with open(path, "rb") as index_file:
+            buffer = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, docs, deleted)
+
+    # sorted list of terms, decoded from the term blob on first use; for going through every term
+    @property
+    def terms(self):
+        if self._terms is None:
+            blob = bytes(self.buffer[self.term_blob_offset:self.term_blob_offset + int(self.term_offsets[-1])])
+            self._terms = [blob[start:end].decode("utf-8")
+                           for start, end in zip(self.term_offsets[:-1].tolist(), self.term_offsets[1:].tolist())]
+        return self._terms
+
+    # index of term in term table, or -1 if term was never indexed
+    # until the list of every term has been built (to go through them all), a binary search that only
+    # decodes the terms it compares with, so looking terms up (as search does) never builds it
+    def term_id(self, term):
+        terms = self.term_list if self._terms is None else self._terms
+        i = bisect.bisect_left(terms, term)
+        if i < self.n_terms and terms[i] == term:
+            return i
+        return -1
+
+    def __len__(self):
+        return self.n_terms
+
+    def __contains__(self, term):
+        return self.term_id(term) != -1
+
+    # boolean mask of the rows that are not deleted
+    def live(self, rows):
+        return ~np.isin(rows, self.deleted)
+
+    # decode a term's postings into (rows, counts, positions) arrays
+    # positions are concatenated in row order; counts gives how many belong to each row
+    # with rows (sorted), only the blocks that can hold those rows are decoded: the postings returned
+    # include those of rows, but may hold other rows as well
+    def postings(self, term, rows=None):
+        term_id = self.term_id(term)
+        if term_id == -1:
+            raise KeyError(term)
+        doc_freq = int(self.doc_freqs[term_id])
+        start, end = int(self.block_offsets[term_id]), int(self.block_offsets[term_id + 1])
+        if self.block_size is None:
+            values = varint_decode(self.buffer[start:end]).astype(np.int64)
+            return positions_of(np.cumsum(values[:doc_freq]), values[doc_freq:2 * doc_freq],
+                                values[2 * doc_freq:])
+
+        n_blocks = -(-doc_freq // self.block_size)
+        if n_blocks <= 1:
+            return positions_of(*self.decode_block(start, end, doc_freq, 0))
+        last_rows = np.frombuffer(self.buffer, dtype="<i8", count=n_blocks, offset=start)
+        data_start = start + 16 * n_blocks
+        block_offsets = np.empty(n_blocks + 1, dtype=np.int64)
+        block_offsets[0] = data_start
+        block_offsets[1:] = data_start + np.frombuffer(self.buffer, dtype="<i8", count=n_blocks,
+                                                       offset=start + 8 * n_blocks)
+        if rows is None:
+            blocks = range(n_blocks)
+        else:
+            # block i holds rows after the last row of block i - 1, up to its own last row
+            blocks = np.unique(np.searchsorted(last_rows, rows))
+            blocks = blocks[blocks < n_blocks].tolist()
+        decoded = []
+        for block in blocks:
+            n = min(self.block_size, doc_freq - block * self.block_size)
+            decoded.append(self.decode_block(int(block_offsets[block]), int(block_offsets[block + 1]), n,
+                                             int(last_rows[block - 1]) if block else 0))
+        if not decoded:
+            return (np.empty(0, dtype=np.int64),) * 3
+        return positions_of(*(np.concatenate(arrays) for arrays in zip(*decoded)))
+
+    # (rows, counts, position gaps) of the n documents of the block from offset to end
+    # base is the row its row gaps start from
+    def decode_block(self, offset, end, n, base):
+        if self.codec == "varint":
+            # a block is all varints, so the three arrays are decoded in one go
+            values = varint_decode(self.buffer[offset:end]).astype(np.int64)
+            return base + np.cumsum(values[:n]), values[n:2 * n], values[2 * n:]
+        decode = DECODERS[self.codec]
+        values, offset = decode(self.buffer, 2 * n, offset)
+        values = values.astype(np.int64)
+        position_gaps, _ = decode(self.buffer, int(values[n:].sum()), offset)
+        return base + np.cumsum(values[:n]), values[n:], position_gaps.astype(np.int64)
+
+    # same shape as the old dict-of-dicts index: {doc_id: [positions]} for a single term
+    def __getitem__(self, term):
+        rows, counts, positions = self.postings(term)
+        doc_positions = np.split(positions, np.cumsum(counts)[:-1])
+        return {row if self.docs is None else self.docs[row]: row_positions.tolist()
+                for row, row_positions, live in zip(rows.tolist(), doc_positions, self.live(rows)) if live}
+
+    # rows of documents in which terms (analyzed words of a phrase) appear consecutively, in order
+    # every term's positions are turned into sorted (row, start of phrase) keys, restricted to
+    # documents containing every term; starting from the rarest term, the keys are intersected with
+    # those of each other term by binary search, so the work is proportional to the rarer terms
+    # postings of the other terms are only decoded in the blocks that can hold rows of the rarer ones
+    def phrase_rows(self, terms):
+        term_ids = [self.term_id(term) for term in terms]
+        if len(terms) == 0 or -1 in term_ids:
+            return np.empty(0, dtype=np.int64)
+        # terms in increasing order of document frequency
+        order = sorted(range(len(terms)), key=lambda i: self.doc_freqs[term_ids[i]])
+
+        # documents containing every term (and not deleted)
+        postings = [None] * len(terms)
+        postings[order[0]] = self.postings(terms[order[0]])
+        rows = postings[order[0]][0]
+        for i in order[1:]:
+            postings[i] = self.postings(terms[i], rows)
+            rows = np.intersect1d(rows, postings[i][0], assume_unique=True)
+        rows = rows[self.live(rows)]
+
+        keys = None
+        for i in order:
+            term_rows, counts, positions = postings[i]
+            # positions of term i in candidate documents, shifted back to where the phrase would start
+            keep = np.repeat(np.isin(term_rows, rows, assume_unique=True), counts) & (positions >= i)
+            term_keys = (np.repeat(term_rows, counts)[keep] << 32) | (positions[keep] - i)
+            if keys is None:
+                keys = term_keys
+            else:
+                found = np.searchsorted(term_keys, keys)
+                found[found == len(term_keys)] = 0
+                keys = keys[term_keys[found] == keys] if len(term_keys) else term_keys
+            if len(keys) == 0:
+                break
+        return np.unique(keys >> 32)
+
+# (rows, counts, positions) from rows, counts and the position gaps of every document
+def positions_of(rows, counts, position_gaps):
+    # cumulative sum of gaps, restarted at the start of every document
+    running = np.cumsum(position_gaps)
+    doc_starts = np.cumsum(counts) - counts
+    positions = running - np.repeat(running[doc_starts] - position_gaps[doc_starts], counts)
+    return rows, counts, positions
+
+# copy every term of positions to writer with its rows renumbered: row r becomes new_rows[r], and
+# rows mapped to -1 are left out; each term's postings are reordered to follow its new rows
+def remap_rows(positions, writer, new_rows):
+    for term in positions.terms:
+        rows, counts, term_positions = positions.postings(term)
+        mapped = new_rows[rows]
+        # postings kept, in order of their new rows
+        kept = np.flatnonzero(mapped != -1)
+        kept = kept[np.argsort(mapped[kept], kind="stable")]
+        if len(kept) == 0:
+            continue
+        # gather the positions of each kept posting, from where they start in term_positions
+        starts = np.cumsum(counts) - counts
+        kept_counts = counts[kept]
+        kept_starts = np.cumsum(kept_counts) - kept_counts
+        gather = np.arange(int(kept_counts.sum())) + np.repeat(starts[kept] - kept_starts, kept_counts)
+        writer.add(term, mapped[kept], kept_counts, term_positions[gather])
@@ -0,0 +1,70 @@
+import os
+import struct
+import numpy as np
+from scipy import sparse
+
+# optional quantization of the document weights of the matrix (and its CSC copy)
+# uint8/uint16: every weight is stored as an integer multiple of its term's scale, the largest weight
+#   of the term divided by the largest integer of the type; scoring folds the scale into the query
+#   weight and sums scores as integers (see scoring.py)
+# float16: weights are stored as half floats and scored like float32 weights
+# weights that are not 0 are never rounded down to 0, so a query matches the same documents
+
+QUANTIZATIONS = ("uint8", "uint16", "float16")
+
+#### SCALES FORMAT (single file, little-endian)
+# header: magic, format version, number of terms
+# scales float32[n_terms]: weight of one unit of each column of an integer-quantized matrix
+
+MAGIC = b"SCALES\0\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+
+# quantized copy of a CSR or CSC matrix, and the scale of every column (None for float16)
+def quantize(matrix, quantization):
+    if quantization not in QUANTIZATIONS:
+        raise ValueError("unknown quantization: " + quantization)
+    matrix = matrix.tocsr()
+    if quantization == "float16":
+        data = matrix.data.astype(np.float16)
+        # weights too small for a half float keep the smallest one instead of becoming 0
+        data[(data == 0) & (matrix.data != 0)] = np.finfo(np.float16).smallest_subnormal
+        return sparse.csr_matrix((data, matrix.indices, matrix.indptr), shape=matrix.shape), None
+    levels = np.iinfo(quantization).max
+    max_weights = np.zeros(matrix.shape[1], dtype=np.float32)
+    np.maximum.at(max_weights, matrix.indices, matrix.data)
+    # empty columns get a scale of 1, so dividing by it is always safe
+    scales = np.where(max_weights > 0, max_weights / levels, 1).astype(np.float32)
+    units = np.rint(matrix.data / scales[matrix.indices])
+    units[(units == 0) & (matrix.data != 0)] = 1
+    return sparse.csr_matrix((units.astype(quantization), matrix.indices, matrix.indptr), shape=matrix.shape), scales
+
+# CSC copy of a CSR matrix with the same weight type; scipy's tocsc turns float16 weights into float32,
+# so the positions of the weights are transposed instead, and the weights gathered in CSC order
+def csc_copy(matrix):
+    if matrix.dtype != np.float16:
+        return matrix.tocsc()
+    positions = sparse.csr_matrix((np.arange(matrix.nnz, dtype=np.int64), matrix.indices, matrix.indptr),
+                                  shape=matrix.shape).tocsc()
+    return sparse.csc_matrix((matrix.data[positions.data], positions.indices, positions.indptr), shape=matrix.shape)
+
+# float32 weights of a (CSR) quantized matrix, e.g. to update it or to refine a query towards its rows
+def dequantize(matrix, scales):
+    data = matrix.data.astype(np.float32)
+    if scales is not None:
+        data *= scales[matrix.indices]
+    return sparse.csr_matrix((data, matrix.indices, matrix.indptr), shape=matrix.shape)
+
+# written to a temp file first, as the scales may be mapped from the file being replaced
+def save_scales(scales, path):
+    temp_path = os.path.join(os.path.dirname(path), "temp-" + os.path.basename(path))
+    with open(temp_path, "wb") as scales_file:
+        scales_file.write(HEADER.pack(MAGIC, VERSION, 0, len(scales)))
+        scales_file.write(np.asarray(scales, dtype="<f4").tobytes())
+    os.replace(temp_path, path)
+
+def scales_from_buffer(buffer):
+    magic, version, _, n_terms = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a scales file (or unsupported version)")
+    return np.frombuffer(buffer, dtype="<f4", count=n_terms, offset=HEADER.size)
@@ -0,0 +1,219 @@
+import os
+import struct
+import numpy as np
+from scipy import sparse
+
+# query weights of an index with integer (quantized) weights are rounded to integers up to this large
+QUERY_LEVELS = 2 ** 16 - 1
+
+# term-at-a-time scoring over the CSC copy of the (l2-normalized) document matrix
+# only the columns of the query's terms are read, so scoring a query costs time proportional
+# to the total length of its terms' postings, not to the size of the corpus
+# columns quantized to integers (quantize.py) come with the scale of every column; scores are then
+# summed as int64 in units of the query's unit (see query_weights), which is exact
+class TermAtATimeScorer:
+    def __init__(self, columns, scales=None):
+        self.columns = columns
+        self.scales = scales
+        # scores are accumulated here; entries touched by a query are reset after it, so it is
+        # allocated once and reused by every query
+        self.accumulator = np.zeros(columns.shape[0], dtype=np.float32 if scales is None else np.int64)
+
+    # weights of columns between start and end (only those at positions, if given), in the accumulator's
+    # type: float16 weights are multiplied in float32, whatever numpy's rules for a float32 scalar
+    # times a float16 array
+    def weights_of(self, start, end, positions=None):
+        weights = self.columns.data[start:end]
+        if positions is not None:
+            weights = weights[positions]
+        return weights.astype(self.accumulator.dtype, copy=False)
+
+    # terms of query_vector (a 1 x n_terms sparse vector) in increasing column order, their weights
+    # in the units scores are accumulated in, and the size of that unit
+    # with quantized columns, each term's scale is folded into its weight, which is then rounded
+    # to a multiple of the unit: the largest folded weight over QUERY_LEVELS
+    def query_weights(self, query_vector):
+        query_vector = query_vector.tocsr()
+        query_vector.sort_indices()
+        terms = query_vector.indices.astype(np.int64)
+        weights = query_vector.data.astype(np.float32)
+        if self.scales is None or len(terms) == 0:
+            return terms, weights, 1
+        weights = weights * self.scales[terms]
+        unit = np.abs(weights).max() / QUERY_LEVELS
+        return terms, np.rint(weights / unit).astype(np.int64), unit
+
+    # scores summed in the accumulator's units, as float32 scores
+    def to_scores(self, sums, unit):
+        return sums if self.scales is None else (sums * unit).astype(np.float32)
+
+    # rows of documents with a non-zero score for query_vector (a 1 x n_terms sparse vector),
+    # in increasing order, and their scores (dot products with query_vector)
+    def score(self, query_vector):
+        columns, accumulator = self.columns, self.accumulator
+        terms, weights, unit = self.query_weights(query_vector)
+        touched = []
+        # terms in increasing column order, so every score is summed in the same order as in a
+        # sparse matrix product
+        for term, weight in zip(terms.tolist(), weights):
+            start, end = columns.indptr[term], columns.indptr[term + 1]
+            rows = columns.indices[start:end]
+            # rows within a column are unique, so fancy-indexed += adds every posting
+            accumulator[rows] += weight * self.weights_of(start, end)
+            touched.append(rows)
+        if not touched:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.unique(np.concatenate(touched))
+        sums = accumulator[rows]
+        accumulator[rows] = 0
+        nonzero = sums != 0
+        return rows[nonzero], self.to_scores(sums[nonzero], unit)
+
+    # scores of the given rows (sorted) only; each term's postings are probed (by binary search) at
+    # those rows, in increasing column order, so scores are summed in the same order as by score
+    def score_rows(self, query_vector, rows):
+        columns = self.columns
+        terms, weights, unit = self.query_weights(query_vector)
+        sums = np.zeros(len(rows), dtype=self.accumulator.dtype)
+        for term, weight in zip(terms.tolist(), weights):
+            start, end = columns.indptr[term], columns.indptr[term + 1]
+            found, positions = probe(columns.indices[start:end], rows)
+            sums[found] += weight * self.weights_of(start, end, positions[found])
+        return self.to_scores(sums, unit)
+
+    # scores of every row for a batch of queries (rows of query_vectors) with one sparse product
+    # with matrix, the CSR copy of the columns; same scores as score
+    def score_product(self, matrix, query_vectors):
+        if self.scales is None:
+            return (matrix @ query_vectors.T.tocsr()).T.tocsr()
+        # weights come out in column order
+        query_vectors = query_vectors.tocsr().sorted_indices()
+        weights, units = [], []
+        for i in range(query_vectors.shape[0]):
+            _, query_weights, unit = self.query_weights(query_vectors[i])
+            weights.append(query_weights)
+            units.append(unit)
+        queries = sparse.csr_matrix((np.concatenate(weights) if weights else np.empty(0, dtype=np.int64),
+                                     query_vectors.indices, query_vectors.indptr), shape=query_vectors.shape)
+        sums = (matrix @ queries.T.tocsr()).T.tocsr()
+        data = self.to_scores(sums.data, np.repeat(np.array(units, dtype=np.float64), np.diff(sums.indptr)))
+        return sparse.csr_matrix((data, sums.indices, sums.indptr), shape=sums.shape)
+
+#### MAX IMPACTS FORMAT (single file, little-endian)
+# header: magic, format version, number of terms
+# max impacts float32[n_terms]: largest weight of each column of the matrix, an upper bound on
+# what a term can add to any document's score (times the term's weight in the query)
+
+MAGIC = b"IMPACTS\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+
+# slack on score bounds, so float32 rounding of partial sums never prunes a document that could
+# still reach the top k
+BOUND_SLACK = 1e-5
+
+# written to a temp file first, as the impacts may be mapped from the file being replaced
+def save_max_impacts(columns, path):
+    max_impacts = np.zeros(columns.shape[1], dtype="<f4")
+    nonempty = np.flatnonzero(np.diff(columns.indptr))
+    if len(nonempty) != 0:
+        # reduceat over the starts of non-empty columns only; empty columns hold no values to skip over
+        max_impacts[nonempty] = np.maximum.reduceat(columns.data, columns.indptr[nonempty])
+    temp_path = os.path.join(os.path.dirname(path), "temp-" + os.path.basename(path))
+    with open(temp_path, "wb") as impacts_file:
+        impacts_file.write(HEADER.pack(MAGIC, VERSION, 0, len(max_impacts)))
+        impacts_file.write(max_impacts.tobytes())
+    os.replace(temp_path, path)
+
+def max_impacts_from_buffer(buffer):
+    magic, version, _, n_terms = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a max impacts file (or unsupported version)")
+    return np.frombuffer(buffer, dtype="<f4", count=n_terms, offset=HEADER.size)
+
+# top-k scoring with MaxScore pruning, using per-term max impacts precomputed by index.py
+# terms are processed in decreasing order of their score upper bound; once the k-th best partial
+# score is above what the remaining terms could add up to, no document missing from the postings
+# seen so far can reach the top k, and the remaining terms' postings are only probed (by binary
+# search) at the remaining candidates; candidates whose upper bound drops below the k-th best
+# score are dropped as well
+# whole postings are processed with numpy instead of one document at a time, which would mean a
+# python loop per posting
+class MaxScoreScorer(TermAtATimeScorer):
+    def __init__(self, columns, max_impacts, scales=None):
+        super().__init__(columns, scales)
+        self.max_impacts = max_impacts
+        # rows already in the postings of a processed term; reset after every query like the accumulator
+        self.seen = np.zeros(columns.shape[0], dtype=bool)
+
+    # rows and scores of a superset of the k best documents for query_vector (rows in deleted, a
+    # boolean array by row, are left out), and the number of postings that were never scored
+    # scores are the same as TermAtATimeScorer.score's, so ranking them gives the same top k
+    def top_k(self, query_vector, k, deleted=None):
+        columns, accumulator, seen = self.columns, self.accumulator, self.seen
+        # weights (and max impacts) are in the units scores are accumulated in
+        terms, weights, _ = self.query_weights(query_vector)
+        starts, ends = columns.indptr[terms], columns.indptr[terms + 1]
+        total_postings = int((ends - starts).sum())
+
+        bounds = weights.astype(np.float64) * self.max_impacts[terms]
+        order = np.argsort(-bounds, kind="stable")
+        # remaining_bounds[j]: most that terms order[j:] can add to a document's score
+        remaining_bounds = np.zeros(len(terms) + 1)
+        remaining_bounds[:-1] = np.cumsum(bounds[order][::-1])[::-1]
+        scored_postings = 0
+        touched = []
+        candidates = np.empty(0, dtype=np.int64)
+        threshold = 0
+
+        # terms with the largest bounds: any document in their postings may reach the top k
+        j = 0
+        while j < len(terms):
+            term = order[j]
+            rows = columns.indices[starts[term]:ends[term]]
+            accumulator[rows] += weights[term] * self.weights_of(starts[term], ends[term])
+            touched.append(rows)
+            scored_postings += len(rows)
+            j += 1
+            new_rows = rows[~seen[rows]]
+            seen[rows] = True
+            if deleted is not None:
+                new_rows = new_rows[~deleted[new_rows]]
+            candidates = np.concatenate((candidates, new_rows))
+            if len(candidates) >= k:
+                threshold = kth_largest(accumulator[candidates], k)
+                if remaining_bounds[j] * (1 + BOUND_SLACK) < threshold:
+                    break
+
+        # remaining terms: only add their weights to candidates that can still reach the top k
+        candidates = np.sort(candidates)
+        while j < len(terms):
+            candidates = candidates[(accumulator[candidates] + remaining_bounds[j]) * (1 + BOUND_SLACK) >= threshold]
+            term = order[j]
+            rows = columns.indices[starts[term]:ends[term]]
+            found, positions = probe(rows, candidates)
+            accumulator[candidates[found]] += weights[term] * self.weights_of(starts[term], ends[term], positions[found])
+            scored_postings += int(found.sum())
+            j += 1
+            threshold = max(threshold, kth_largest(accumulator[candidates], k))
+        candidates = candidates[accumulator[candidates] * (1 + BOUND_SLACK) >= threshold]
+
+        for rows in touched:
+            accumulator[rows] = 0
+            seen[rows] = False
+        # rescore the surviving candidates with terms in column order, so their scores are summed in
+        # exactly the same order as by term-at-a-time (or sparse product) scoring
+        scores = self.score_rows(query_vector, candidates)
+        nonzero = scores != 0
+        return candidates[nonzero], scores[nonzero], total_postings - scored_postings
+
+# k-th largest value of values (k <= len(values))
+def kth_largest(values, k):
+    return values[np.argpartition(-values, k - 1)[k - 1]]
+
+# which of candidates (sorted) appear in rows (sorted postings of a term), and where
+def probe(rows, candidates):
+    positions = np.searchsorted(rows, candidates)
+    found = positions < len(rows)
+    found[found] = rows[positions[found]] == candidates[found]
+    return found, np.minimum(positions, max(len(rows) - 1, 0))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import os
+import sys
+import getopt
+import subprocess
+
+# cold-start budget of search.py: runs it in a fresh interpreter with -X importtime and reports
+# how long its imports take, the slowest of them, and any of the modules search.py is meant to
+# only import when a query needs them
+# exits with status 1 if the import time is over budget, so regressions fail the makefile target
+
+# milliseconds; importing search (numpy, scipy.sparse and the index modules) takes about 300ms
+IMPORT_BUDGET_MS = 500
+
+# modules that take seconds to import and that search.py must not load on its own: nltk is only
+# needed to stem words missing from the stem cache, or for synonyms without a synonym table;
+# scikit-learn only to unpickle dictionaries of older builds
+DEFERRED_MODULES = ("nltk", "sklearn")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def usage():
+    print("usage: " + sys.argv[0] + " [-b budget-ms] [-n runs] [-d dictionary-file -p postings-file -q query-file [-o output-file]]")
+    print("       without -q, times importing search.py; with it, times the imports of a whole query,")
+    print("       writing its results to output-file (default: discarded)")
+
+# (module, self time, cumulative time, depth) of every import, times in microseconds
+def import_times(command):
+    process = subprocess.run([sys.executable, "-X", "importtime"] + command, cwd=REPO_DIR,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        sys.stderr.write(process.stderr)
+        sys.exit(2)
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        # nested imports are indented by two spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(self_time), int(cumulative), depth))
+    return imports
+
+def report(imports, budget_ms):
+    top_level = [entry for entry in imports if entry[3] == 0]
+    total_ms = sum(cumulative for _, _, cumulative, _ in top_level) / 1000
+    print("import time:", round(total_ms, 1), "ms (budget", str(budget_ms) + " ms)")
+    # top-level imports and the modules they import directly, e.g. numpy under search
+    print("slowest imports (cumulative ms):")
+    shallow = [entry for entry in imports if entry[3] <= 1]
+    for name, _, cumulative, depth in sorted(shallow, key=lambda entry: -entry[2])[:10]:
+        print("  " + str(round(cumulative / 1000, 1)).rjust(8), "  " * depth + name)
+    loaded = sorted(set(name.split(".")[0] for name, _, _, _ in imports) & set(DEFERRED_MODULES))
+    if loaded:
+        print("deferred modules imported:", ", ".join(loaded))
+    return total_ms <= budget_ms
+
+if __name__ == '__main__':
+    budget_ms = IMPORT_BUDGET_MS
+    runs = 3
+    dictionary_file = postings_file = file_of_queries = None
+    file_of_output = os.devnull
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'b:n:d:p:q:o:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-b':
+            budget_ms = float(a)
+        elif o == '-n':
+            runs = max(int(a), 1)
+        # search.py runs from the repository directory, so paths are made absolute first
+        elif o == '-d':
+            dictionary_file = os.path.abspath(a)
+        elif o == '-p':
+            postings_file = os.path.abspath(a)
+        elif o == '-q':
+            file_of_queries = os.path.abspath(a)
+        elif o == '-o':
+            file_of_output = os.path.abspath(a)
+        else:
+            assert False, "unhandled option"
+
+    if file_of_queries == None:
+        command = ["-c", "import search"]
+    elif dictionary_file == None or postings_file == None:
+        usage()
+        sys.exit(2)
+    else:
+        command = ["search.py", "-d", dictionary_file, "-p", postings_file, "-q", file_of_queries,
+                   "-o", file_of_output]
+
+    # the fastest of several runs, so a busy disk or cpu does not fail the budget
+    imports = min((import_times(command) for _ in range(runs)),
+                  key=lambda imports: sum(entry[2] for entry in imports if entry[3] == 0))
+    sys.exit(0 if report(imports, budget_ms) else 1)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import time
+import getopt
+import shutil
+import tempfile
+import contextlib
+import subprocess
+import numpy as np
+
+# compares indexes with quantized weights (index.py --quantize) against the float32 baseline:
+# builds an index of the dataset for every quantization, runs every query of a queries directory
+# against each, and reports the size of the index, the mean latency of a query, and how many of
+# the baseline's top k documents each quantization also returns in its top k (overlap@k)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+import search
+from segment import Segment
+from quantize import QUANTIZATIONS
+
+def usage():
+    print("usage: " + sys.argv[0] + " -i dataset-file [-q queries-dir-or-manifest] [-k n] [-r runs] [--lazy-idf]")
+
+# build an index of dataset in directory with index.py, quantized if quantization is not None
+def build(dataset, directory, quantization, lazy_idf):
+    command = [sys.executable, os.path.join(REPO_DIR, "index.py"), "-i", dataset,
+               "-d", "dictionary.txt", "-p", "postings.txt"]
+    if quantization is not None:
+        command += ["--quantize", quantization]
+    if lazy_idf:
+        command.append("--lazy-idf")
+    # index.py asks before overwriting an index
+    subprocess.run(command, cwd=directory, input="y\n", stdout=subprocess.DEVNULL, universal_newlines=True,
+                   check=True)
+
+# top k docIds of every query, and the fastest of runs timings of each query (in seconds)
+def run_queries(index, contents, k, runs):
+    results, latencies = [], []
+    for content in contents:
+        best = None
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = search.search_query(index, content, k)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append(result[0])
+        latencies.append(best)
+    return results, latencies
+
+if __name__ == '__main__':
+    dataset = None
+    queries_path = os.path.join(REPO_DIR, "queries")
+    k = 10
+    runs = 5
+    lazy_idf = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'i:q:k:r:', ['lazy-idf'])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-i':
+            dataset = os.path.abspath(a)
+        elif o == '-q':
+            queries_path = a
+        elif o == '-k':
+            k = int(a)
+        elif o == '-r':
+            runs = max(int(a), 1)
+        elif o == '--lazy-idf':
+            lazy_idf = True
+        else:
+            assert False, "unhandled option"
+
+    if dataset == None:
+        usage()
+        sys.exit(2)
+
+    contents = []
+    for query_file in search.batch_query_files(queries_path):
+        with open(query_file) as query_lines:
+            contents.append(query_lines.readlines())
+
+    work_dir = tempfile.mkdtemp(prefix="quantize-report-")
+    try:
+        baseline = None
+        print("index".ljust(10), "size (bytes)".rjust(14), "matrix (bytes)".rjust(16), "latency (ms)".rjust(14),
+              ("overlap@" + str(k)).rjust(12))
+        for quantization in (None,) + QUANTIZATIONS:
+            name = quantization or "float32"
+            directory = os.path.join(work_dir, name)
+            os.mkdir(directory)
+            build(dataset, directory, quantization, lazy_idf)
+            postings_file = os.path.join(directory, "postings.txt")
+            segment = Segment.open(postings_file)
+            # matrix and its CSC copy: the sections quantization shrinks
+            matrix_size = sum(segment.sections[section][1] for section in ("matrix", "columns", "scales")
+                              if section in segment)
+            # search prints progress for every query
+            with contextlib.redirect_stdout(io.StringIO()):
+                index = search.load_search_index(os.path.join(directory, "dictionary.txt"), postings_file)
+                results, latencies = run_queries(index, contents, k, runs)
+            if baseline is None:
+                baseline = results
+            overlaps = [len(set(result) & set(base)) / len(base) for result, base in zip(results, baseline) if base]
+            print(name.ljust(10), str(os.path.getsize(postings_file)).rjust(14), str(matrix_size).rjust(16),
+                  str(round(1000 * np.mean(latencies), 2)).rjust(14),
+                  str(round(np.mean(overlaps), 4) if overlaps else "-").rjust(12))
+    finally:
+        shutil.rmtree(work_dir)
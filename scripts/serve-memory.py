@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import getopt
+import signal
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# memory of server.py's worker pool (-w) as workers are added: starts the server with every number of
+# workers in turn, sends it every query of a queries directory from as many threads as there are
+# workers (so every worker touches the index), and reports the memory of the server and all of its
+# processes. PSS (proportional set size) counts pages shared by several processes, such as the
+# shared index, once in total; RSS counts them in every process that maps them
+# linux only: memory is read from /proc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+import search
+from client import query_server
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-q queries-dir-or-manifest] [-w 1,2,4,...] [-r rounds]")
+
+# pid and every descendant of pid
+def process_tree(pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/" + entry + "/stat") as stat_file:
+                    # the command name (in parentheses) may hold spaces
+                    ppid = int(stat_file.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        pid = pending.pop()
+        tree.append(pid)
+        pending.extend(children.get(pid, []))
+    return tree
+
+# (pss, rss) of a process, in kB
+def memory_of(pid):
+    memory = {}
+    with open("/proc/" + str(pid) + "/smaps_rollup") as smaps_file:
+        for line in smaps_file:
+            fields = line.split()
+            if fields[0] in ("Pss:", "Rss:"):
+                memory[fields[0]] = int(fields[1])
+    return memory["Pss:"], memory["Rss:"]
+
+def measure(dict_file, postings_file, contents, workers, rounds):
+    socket_file = os.path.join(tempfile.mkdtemp(prefix="serve-memory-"), "search.sock")
+    server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "server.py"), "-d", dict_file, "-p", postings_file,
+                               "-s", socket_file, "-w", str(workers)], stdout=subprocess.DEVNULL)
+    try:
+        while not os.path.exists(socket_file):
+            if server.poll() is not None:
+                print("server.py exited with status", server.returncode)
+                sys.exit(1)
+            time.sleep(0.1)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(lambda content: query_server(socket_file, content), contents * rounds))
+        elapsed = time.perf_counter() - start
+        pss = rss = 0
+        for pid in process_tree(server.pid):
+            try:
+                process_pss, process_rss = memory_of(pid)
+            except OSError:
+                continue
+            pss += process_pss
+            rss += process_rss
+        return pss, rss, elapsed
+    finally:
+        # the server releases the shared index when interrupted
+        server.send_signal(signal.SIGINT)
+        server.wait()
+        os.rmdir(os.path.dirname(socket_file))
+
+if __name__ == '__main__':
+    dictionary_file = postings_file = None
+    queries_path = os.path.join(REPO_DIR, "queries")
+    worker_counts = [1, 2, 4]
+    rounds = 3
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:w:r:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = os.path.abspath(a)
+        elif o == '-p':
+            postings_file = os.path.abspath(a)
+        elif o == '-q':
+            queries_path = a
+        elif o == '-w':
+            worker_counts = [int(count) for count in a.split(",")]
+        elif o == '-r':
+            rounds = max(int(a), 1)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None:
+        usage()
+        sys.exit(2)
+
+    contents = []
+    for query_file in search.batch_query_files(queries_path):
+        with open(query_file) as query_lines:
+            contents.append(query_lines.readlines())
+
+    print("index:", os.path.getsize(postings_file) // 1024, "kB")
+    print("workers".ljust(8), "pss (kB)".rjust(12), "rss (kB)".rjust(12), "queries/s".rjust(12))
+    for workers in worker_counts:
+        pss, rss, elapsed = measure(dictionary_file, postings_file, contents, workers, rounds)
+        print(str(workers).ljust(8), str(pss).rjust(12), str(rss).rjust(12),
+              str(round(len(contents) * rounds / elapsed, 1)).rjust(12))
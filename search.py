@@ -1,75 +1,73 @@
+import os
 import sys
 import time
 import getopt
-import csv
-import gzip
-import pickle
-import nltk
-from nltk.corpus import wordnet
+import itertools
 import numpy as np
-from scipy import mean
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+from vocabulary import Vocabulary
+from positional import PositionalIndex
+from ngrams import NGRAM_SIZES
+from synonyms import synonyms_from_buffer, expand_counts
+from docmap import DocMap
+from matrixfile import matrix_from_buffer
+from scoring import MaxScoreScorer, max_impacts_from_buffer
+from segment import Segment
+from quantize import QUANTIZATIONS, dequantize, scales_from_buffer
+from tombstones import tombstones_from_buffer
+import analysis
+from analysis import StemCache
 
 # query refinement (Rocchio) and synonym expansion options
 # can be enabled or disabled as per your wish
 # query synonyms left on as we found it helps with accuracy
 query_refinement = False
 query_synonym_expansion = True
+# refine queries without relevance judgments towards the FEEDBACK_DOCS best documents of a first
+# retrieval instead (pseudo-relevance feedback)
+pseudo_relevance_feedback = False
 
-# Snowball stemmer for more accurate stemming
-stemmer = nltk.stem.snowball.SnowballStemmer("english")
+# Rocchio weights of the query and of the centroid of relevant documents
+ROCCHIO_ALPHA = 0.7
+ROCCHIO_BETA = 0.3
+# only the FEEDBACK_TERMS highest weighted terms of the centroid are added to a query
+FEEDBACK_TERMS = 100
+# number of first-pass documents taken as relevant by pseudo-relevance feedback
+FEEDBACK_DOCS = 10
 
-# modified version of TfidfVectorizer that converts list of raw text to a term-doc matrix
-# modified to use float32 to save space when saved to disk, and to stem all words automatically
-# used here to convert query to a vector
-class TfidfStemVectorizer(TfidfVectorizer):
-    def __init__(self):
-        super().__init__(self, dtype=np.float32)
-        self.analyze = super().build_analyzer()
+# added to the score of documents matching the phrases of a query
+phrase_boost = 0.1
 
-    # function that processes all text passed to vectorizer when called
-    def build_analyzer(self):
-        # automatically stem all words in text passed to it
-        return lambda doc: (stemmer.stem(word) for word in self.analyze(doc))
+# number of documents ranked at a time when all matching documents are wanted (no -k)
+RANK_CHUNK_SIZE = 1000
 
 def usage():
     print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
+    print("       " + sys.argv[0] + " -d dictionary-file -p postings-file -b queries-dir-or-manifest -o output-dir")
+    print("       -k n: only return the n best documents of each query")
 
 # find phrases in query, as denoted by quotation marks
-def find_docs_for_phrasal_query(query, vectorizer, dictionary):
+# returns the sorted rows of the documents containing the phrase
+def find_docs_for_phrasal_query(query, vectorizer, dictionary, ngrams=None):
     # stem and case-fold terms in query
-    query_words = []
-    for word in vectorizer.build_analyzer()(query):
-        query_words.append(word)
-
-    # get dictionary containing positions of every word in phrase, for every document it appears in
-    position_array = [dictionary[word] for word in query_words]
-    # use set intersections to efficiently obtain common docs all these words appear in
-    common_docs = set.intersection(*[set(array.keys()) for array in position_array])
-
-    final_result = set()
-    # for each common document:
-    for doc in common_docs:
-        # obtain the positions of each word in the phrase, in that document
-        positions = [array[doc] for array in position_array]
-        for pos in positions[0]:
-            # check if the words appear in the right phrasal order in that document
-            exist_check = [pos+i in positions[i] for i in range(1, len(positions))]
-            # if they do (i.e. not False), add document to set
-            # use set to prevent duplicates
-            if False not in exist_check:
-                final_result.add(doc)
-
-    return final_result
+    query_words = vectorizer.build_analyzer()(query)
+
+    # phrases of 2-3 words frequent enough to be in the n-gram index are a single postings lookup
+    if ngrams is not None and len(query_words) in NGRAM_SIZES and " ".join(query_words) in ngrams:
+        rows = ngrams.postings(" ".join(query_words))[0]
+        return rows[ngrams.live(rows)]
+    # intersect sorted position arrays of the words, shifted by their offset in the phrase
+    # (a phrase with a word that was never indexed matches no document)
+    return dictionary.phrase_rows(query_words)
 
 # main query processing function
 # calls phrasal query processing function, and query synonym expansion function (if activated)
-def process_query(query, vectorizer, positions):
+# with a synonym table (synonyms), synonyms are added to the query vector later instead of to the query text
+def process_query(query, vectorizer, positions, ngrams=None, synonyms=None):
     # split query up by ANDs, if any
     queries = query.split(" AND ")
     phrases_found = False
-    phrases_doc_set = set()
+    phrase_rows = np.empty(0, dtype=np.int64)
     phrase_count = 0
     non_phrasal_query = ""
 
@@ -82,16 +80,16 @@ def process_query(query, vectorizer, positions):
             phrases_found = True
             query = query[1:-1]
             # find documents that match phrase
-            phrasal_docs = find_docs_for_phrasal_query(query, vectorizer, positions)
+            phrasal_rows = find_docs_for_phrasal_query(query, vectorizer, positions, ngrams)
             # if multiple phrases in query, they must be ANDed together; intersect their results
             if phrase_count == 0:
-                phrases_doc_set = phrasal_docs
+                phrase_rows = phrasal_rows
             else:
-                phrases_doc_set = set.intersection(phrases_doc_set, phrasal_docs)
+                phrase_rows = np.intersect1d(phrase_rows, phrasal_rows, assume_unique=True)
             query = query.split(" ")
             for j in range(len(query)):
                 term = query[j]
-                if query_synonym_expansion:
+                if query_synonym_expansion and synonyms is None:
                     term = query_synonym_extension(term, vectorizer)
                 non_phrasal_query += term
                 if not (i == len(queries) - 1 and j == len(query) - 1):
@@ -100,32 +98,40 @@ def process_query(query, vectorizer, positions):
         else:
             # free text term in query
             # if synonym expansion enabled; add synonyms of this term to query
-            if query_synonym_expansion:
+            if query_synonym_expansion and synonyms is None:
                 query = query_synonym_extension(query, vectorizer)
             non_phrasal_query += query
             # add space if not final term in query
             if i != len(queries) - 1:
                 non_phrasal_query += " "
-    return (non_phrasal_query, list(phrases_doc_set), phrases_found)
+    return (non_phrasal_query, phrase_rows, phrases_found)
 
 # alpha beta are parameters to be adjusted
-# varargs are vectors of docs of inputs from query
-def rocchio_calculation(alpha, beta, query_vec, doc_vecs):
+# query_vec is a 1 x n_terms sparse vector, doc_vecs the (sparse) rows of documents relevant to it
+# the refined vector stays sparse: the centroid only has the terms of the relevant documents, and
+# is cut down to its n_terms highest weighted terms
+def rocchio_calculation(alpha, beta, query_vec, doc_vecs, n_terms=FEEDBACK_TERMS):
     print("refining query with Rocchio algorithm...")
-    # multiply query vector by weight
-    weighted_query_np = query_vec * alpha
-    # obtain centroid of document vectors known to be relevant
-    mean_np = np.mean(doc_vecs, axis=0)
-    # multiply by weight
-    weighted_mean_np = mean_np * beta
-    # add weighted centroid and query vector together to obtain refined vector
-    final_result = weighted_query_np + weighted_mean_np
-    return final_result
+    doc_vecs = doc_vecs.tocsr()
+    # obtain centroid of document vectors known to be relevant: weights summed by column
+    columns, positions = np.unique(doc_vecs.indices, return_inverse=True)
+    weights = np.bincount(positions.ravel(), weights=doc_vecs.data, minlength=len(columns)) / doc_vecs.shape[0]
+    if n_terms is not None and n_terms < len(columns):
+        # highest weights first, ties broken by column
+        top = np.sort(np.lexsort((columns, -weights))[:n_terms])
+        columns, weights = columns[top], weights[top]
+    centroid = sparse.csr_matrix((weights, columns, [0, len(columns)]), shape=query_vec.shape)
+    # add weighted centroid and weighted query vector together to obtain refined vector
+    return (query_vec * alpha + centroid * beta).astype(query_vec.dtype).tocsr()
 
 # Adding synonyms to expand query
 # Capped to 1 synonym per word to minimise leading the query
 # 2xOriginal terms to ensure original terms have higher weightage than synonyms
+# only used for indexes without a synonym table (synonyms.txt, see synonyms.py)
 def query_synonym_extension(query, vectorizer):
+    # nltk and WordNet's corpus reader take seconds to load; indexes with a synonym table never need them
+    import nltk
+    from nltk.corpus import wordnet
     # split query up into tokens
     list_of_original_terms = nltk.word_tokenize(query)
     new_query_list = []
@@ -148,83 +154,281 @@ def query_synonym_extension(query, vectorizer):
     new_query = " ".join(term for term in new_query_list).strip()
     return new_query
 
-# given list of docs judged by program to be relevant,
-# write docs to output file
-def write_to_file(result_docs, results_file):
-    print(len(result_docs), "matching documents found.")
+# given docs judged by program to be relevant, as chunks of docs in ranked order,
+# write docs to output file; chunks are written as they are produced
+def write_to_file(result_chunks, results_file):
     print("writing to file...")
 
     with open(results_file, 'w') as output_file:
-        write_string = ""
         doc_count = 0
-        for doc in result_docs:
-            doc_count += 1
-            write_string += doc
-            # if not last document in array: add space
-            if doc_count != len(result_docs):
-                write_string += " "
-        output_file.write(write_string)
-
-# main function to run search, that calls query pre-processing functions,
-# query vectorizing functions, query refinement functions, and calculates cosine
-# similarities to obtain relevant document vectors.
-def run_search(dict_file, postings_file, queries_file, results_file):
-    # time search
-    start_time = time.time()
+        for chunk in result_chunks:
+            if len(chunk) == 0:
+                continue
+            # docs are separated by spaces
+            if doc_count != 0:
+                output_file.write(" ")
+            output_file.write(" ".join(chunk))
+            doc_count += len(chunk)
+    print(doc_count, "matching documents found.")
+
+# everything search needs from the index, loaded once
+# (search.py loads it for every query file; server.py keeps it loaded between queries)
+class SearchIndex:
+    def __init__(self, matrix, vectorizer, docs, tombstones, positions, scorer=None, ngrams=None, synonyms=None):
+        self.matrix = matrix
+        self.vectorizer = vectorizer
+        self.docs = docs
+        self.tombstones = tombstones
+        self.positions = positions
+        self.scorer = scorer
+        self.ngrams = ngrams
+        self.synonyms = synonyms
+        # tombstones as a boolean array by row, for filtering matches and top-k scoring
+        self.deleted = None
+        if len(tombstones) != 0:
+            self.deleted = np.zeros(matrix.shape[0], dtype=bool)
+            self.deleted[tombstones] = True
+
+    # weights of rows of the matrix, as float32 if the index was built with quantized weights
+    def document_vectors(self, rows):
+        vectors = self.matrix[rows, :]
+        if self.matrix.dtype.name in QUANTIZATIONS:
+            vectors = dequantize(vectors, self.scorer.scales)
+        return vectors
 
-    # load term-doc vector matrix, vectorizer, matrix column - termId mapping, word positions index
+# load term-doc vector matrix, vectorizer, matrix column - termId mapping, word positions index
+def load_search_index(dict_file, postings_file):
     print("loading files from disk...")
-    with gzip.open(postings_file, 'rb') as post_file:
-        matrix = pickle.load(post_file)
-    with gzip.open(dict_file, 'rb') as dict_file:
-        vectorizer = pickle.load(dict_file)
-    with gzip.open('docs.txt', 'rb') as doc_file:
-        docs = pickle.load(doc_file)
-    with gzip.open('positions.txt', 'rb') as posn_file:
-        positions = pickle.load(posn_file)
-
-    # retrieve query and relevance judgments from file
-    print("processing query...")
-    relevant_cols = []
-    with open(queries_file) as query_file:
-        content = query_file.readlines()
+    return load_segment(open_segment(postings_file))
+
+# segment at postings_file; exits with a message if it is not one
+# indexes built before segments kept every structure in its own file, in formats search no longer reads
+def open_segment(postings_file):
+    try:
+        return Segment.open(postings_file)
+    except ValueError:
+        print("index was built by an older version of index.py; rebuild it with index.py")
+        sys.exit(2)
+
+# every structure is a section of the segment, wrapped straight from the mapped file; a section's
+# pages are only read from disk when a query touches them
+def load_segment(segment):
+    matrix = matrix_from_buffer(segment.section('matrix'))
+    # scale of every term, if weights were quantized to integers
+    scales = scales_from_buffer(segment.section('scales')) if 'scales' in segment else None
+    scorer = MaxScoreScorer(matrix_from_buffer(segment.section('columns')),
+                            max_impacts_from_buffer(segment.section('impacts')), scales)
+    vectorizer = Vocabulary(segment.section('vocabulary'))
+    docs = DocMap.from_buffer(segment.section('docmap'))
+    tombstones = tombstones_from_buffer(segment.section('tombstones'))
+    analysis.set_stem_cache(StemCache.from_buffer(segment.section('stems')))
+    positions = PositionalIndex(segment.section('positions'), docs, tombstones)
+    ngrams = PositionalIndex(segment.section('ngrams'), docs, tombstones) if 'ngrams' in segment else None
+    synonyms = synonyms_from_buffer(segment.section('synonyms')) if 'synonyms' in segment else None
+    return SearchIndex(matrix, vectorizer, docs, tombstones, positions, scorer, ngrams, synonyms)
+
+# answer one query; content holds the lines of a query file (query, then relevance judgments)
+def search_query(index, content, k=None):
+    return search_queries(index, [content], k)[0]
+
+# answer a batch of queries; contents holds the lines of each query file
+# calls query pre-processing functions, query vectorizing functions and query refinement functions
+# for every query, then scores all free-text queries against the documents (see score_documents)
+# returns, for every query, its matching docs as chunks in ranked order: a single chunk of the
+# k best docs if k is given, else all matching docs, ranked lazily RANK_CHUNK_SIZE docs at a time
+def search_queries(index, contents, k=None):
+    vectorizer, docs = index.vectorizer, index.docs
+    positions, ngrams = index.positions, index.ngrams
+
+    print("processing queries..." if len(contents) > 1 else "processing query...")
+    processed = []
+    for content in contents:
+        relevant_cols = []
         unprocessed_query = content[0].strip()
-        # process phrases and boolean elements of query, return documents that match phrase (if any)
-        (query, phrases_doc_list, phrases_found) = process_query(unprocessed_query, vectorizer, positions)
+        # process phrases and boolean elements of query, return rows of documents that match phrase (if any)
+        (query, phrase_rows, phrases_found) = process_query(unprocessed_query, vectorizer, positions, ngrams,
+                                                                   index.synonyms)
         # retrieve relevance judgments
         for i in range(1, len(content)):
-            relevant_cols.append(docs.index(content[i].strip()))
+            row = docs.row(content[i].strip())
+            # judgments of documents not in index (or deleted since) are ignored
+            if row != -1 and (index.deleted is None or not index.deleted[row]):
+                relevant_cols.append(row)
+        processed.append((query, phrase_rows, phrases_found, relevant_cols))
 
     print("finding matching documents...")
-    # if query comprised entirely of phrases: just return documents from query processing function earlier
-    if query == "":
-        for doc in phrases_doc_list:
-            if doc not in relevant_cols:
-                relevant_cols.append(doc)
-        write_to_file(relevant_cols, results_file)
-    # if free-text elements also exist: convert to vector
+    # vectorize free-text parts of all queries at once; queries comprised entirely of phrases get no vector
+    free_text = [i for i, (query, _, _, _) in enumerate(processed) if query != ""]
+    if query_synonym_expansion and index.synonyms is not None:
+        # add synonyms of query terms with a lookup in the synonym table
+        query_counts = expand_counts(vectorizer.count([processed[i][0] for i in free_text]), index.synonyms)
+        query_vectors = vectorizer.weight(query_counts)
     else:
-        # vectorize query
-        query_vector = vectorizer.transform([query])
-        # if enabled, use Rocchio algorithm to optimize query vector
-        if query_refinement and len(relevant_cols) != 0:
-            relevant_vectors = matrix[relevant_cols, :]
-            refined_vector = rocchio_calculation(0.7, 0.3, query_vector, relevant_vectors)
-        # else, use query vector to calculate cosine scores straightaway
+        query_vectors = vectorizer.transform([processed[i][0] for i in free_text])
+    # rows of the documents each free-text query is refined towards with the Rocchio algorithm, if enabled:
+    # its judged relevant documents, or the best documents of a first retrieval if it has no judgments
+    feedback_rows = [processed[i][3] if query_refinement else [] for i in free_text]
+    if pseudo_relevance_feedback:
+        unjudged = [j for j, i in enumerate(free_text) if len(processed[i][3]) == 0]
+        if unjudged:
+            first_pass = score_documents(query_vectors[unjudged], index, FEEDBACK_DOCS)
+            for j, (rows, cosine_similarities) in zip(unjudged, first_pass):
+                if index.deleted is not None:
+                    live = ~index.deleted[rows]
+                    rows, cosine_similarities = rows[live], cosine_similarities[live]
+                feedback_rows[j] = rows[top_ranked(index.docs.ranks[rows], cosine_similarities, FEEDBACK_DOCS)].tolist()
+    if any(feedback_rows):
+        query_vectors = sparse.vstack([rocchio_calculation(ROCCHIO_ALPHA, ROCCHIO_BETA, query_vectors[j],
+                                                           index.document_vectors(rows))
+                                       if rows else query_vectors[j] for j, rows in enumerate(feedback_rows)],
+                                      format='csr')
+    scores = score_documents(query_vectors, index, k)
+
+    # row of each free-text query in query_vectors and scores
+    score_rows = {i: k for k, i in enumerate(free_text)}
+    results = []
+    for i, (query, phrase_rows, phrases_found, relevant_cols) in enumerate(processed):
+        # if query comprised entirely of phrases: documents judged relevant, then documents matching the phrases
+        if query == "":
+            rows = np.array(relevant_cols, dtype=np.int64)
+            cosine_similarities = np.ones(len(rows), dtype=np.float32)
         else:
-            refined_vector = query_vector
+            # rows of documents with non-zero cosine similarity with query vector, and their similarities
+            rows, cosine_similarities = scores[score_rows[i]]
+            # deleted documents never match
+            matching = cosine_similarities != 0
+            if index.deleted is not None:
+                matching &= ~index.deleted[rows]
+            rows, cosine_similarities = rows[matching], cosine_similarities[matching]
+            # top-k scoring leaves out documents that cannot reach the top k by similarity alone;
+            # the phrase boost may lift those matching the phrases into it, so they are scored too
+            if phrases_found and k is not None:
+                unscored = phrase_rows[~np.isin(phrase_rows, rows)]
+                rows = np.concatenate((rows, unscored))
+                cosine_similarities = np.concatenate((cosine_similarities,
+                                                      index.scorer.score_rows(query_vectors[score_rows[i]], unscored)))
+        if phrases_found:
+            rows, cosine_similarities = fuse_phrase_matches(rows, cosine_similarities, phrase_rows, len(docs))
+
+        result_chunks = ranked_docs(docs, rows, cosine_similarities, RANK_CHUNK_SIZE if k is None else k)
+        if k is not None:
+            result_chunks = [list(itertools.islice(itertools.chain.from_iterable(result_chunks), k))]
+        results.append(result_chunks)
+    return results
+
+# positions (into ranks and scores) of the k best documents, in ranked order:
+# decreasing score, ties broken by rank (the order documents were read in, see docmap.py), so
+# results do not depend on the order of the rows
+# only documents scoring at least the k-th best score (found with argpartition) are sorted
+def top_ranked(ranks, scores, k):
+    if k < len(scores):
+        kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        candidates = np.flatnonzero(scores >= kth_score)
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((ranks[candidates], -scores[candidates]))][:k]
+
+# rows in ranked order, chunk_size rows at a time
+# the first chunk is picked with argpartition (top_ranked); the remaining rows are only sorted, once,
+# if a second chunk is asked for
+def ranked_chunks(rows, ranks, scores, chunk_size):
+    if len(rows) == 0:
+        return
+    best = top_ranked(ranks, scores, chunk_size)
+    yield rows[best]
+    if len(best) == len(rows):
+        return
+    rest = np.ones(len(rows), dtype=bool)
+    rest[best] = False
+    rest = np.flatnonzero(rest)
+    rest = rest[np.lexsort((ranks[rest], -scores[rest]))]
+    for start in range(0, len(rest), chunk_size):
+        yield rows[rest[start:start + chunk_size]]
+
+# docIds of ranked rows, in chunks
+def ranked_docs(docs, rows, scores, chunk_size):
+    for chunk in ranked_chunks(rows, docs.ranks[rows], scores, chunk_size):
+        yield [docs[row] for row in chunk.tolist()]
 
-        # calculate cosine distance of each document vector in matrix with query vector
-        cosine_similarities = cosine_similarity(refined_vector, matrix).flatten()
-        # sort document vectors in decreasing order of cosine similarity from query vector
-        sorted_cosines = cosine_similarities.argsort()[::-1]
-        # return all vectors with non-zero cosine similarity, in that decreasing order
-        result_docs = [docs[doc] for doc in sorted_cosines if cosine_similarities[doc] != 0]
+# fuse the documents matching a query's phrases (phrase_rows) into its scored documents (rows, scores):
+# documents matching the phrases get phrase_boost added to their score, and those that have no
+# score yet join with phrase_boost as their score; n_docs is the number of rows in the matrix
+def fuse_phrase_matches(rows, scores, phrase_rows, n_docs):
+    phrase_match = np.zeros(n_docs, dtype=bool)
+    phrase_match[phrase_rows] = True
+    scored = np.zeros(n_docs, dtype=bool)
+    scored[rows] = True
+    # each document appears once: phrase matches already scored are not added again
+    unscored = phrase_rows[~scored[phrase_rows]]
+    rows = np.concatenate((rows, unscored))
+    scores = np.concatenate((scores, np.zeros(len(unscored), dtype=scores.dtype)))
+    return rows, scores + np.float32(phrase_boost) * phrase_match[rows]
 
-        if phrases_found: # i.e. phrases were found, intersect results w/ phrase document set
-            result_docs.extend([doc for doc in phrases_doc_list if doc not in result_docs])
+# cosine similarities of every query vector (rows of query_vectors) with every document, as a
+# (rows, similarities) pair per query holding the documents with a non-zero similarity
+# document rows are already l2-normalized, and normalizing a query does not change its ranking,
+# so dot products are enough
+# with k, only (a superset of) the k best documents are scored, with MaxScore pruning
+# otherwise queries are scored term-at-a-time over the columns of their terms, unless their terms'
+# postings add up to more than the whole matrix (large batches); those are scored with one sparse
+# product, computed as matrix x queries^T so the matrix is used in the CSR layout it is stored in
+def score_documents(query_vectors, index, k=None):
+    scorer = index.scorer
+    if k is not None:
+        scores = []
+        skipped_postings = 0
+        for i in range(query_vectors.shape[0]):
+            rows, cosine_similarities, skipped = scorer.top_k(query_vectors[i], k, index.deleted)
+            scores.append((rows, cosine_similarities))
+            skipped_postings += skipped
+        print(skipped_postings, "of", np.diff(scorer.columns.indptr)[query_vectors.indices].sum(), "postings skipped.")
+        return scores
+    postings = np.diff(scorer.columns.indptr)[query_vectors.indices].sum()
+    if postings < index.matrix.nnz:
+        return [scorer.score(query_vectors[i]) for i in range(query_vectors.shape[0])]
+    scores = scorer.score_product(index.matrix, query_vectors)
+    return [(scores.indices[scores.indptr[i]:scores.indptr[i + 1]], scores.data[scores.indptr[i]:scores.indptr[i + 1]])
+            for i in range(scores.shape[0])]
 
-        write_to_file(result_docs, results_file)
+# query files of a batch: every file in a directory, or the files listed (one per line) in a manifest file
+# paths in a manifest are relative to the manifest's directory
+def batch_query_files(queries_path):
+    if os.path.isdir(queries_path):
+        return [os.path.join(queries_path, name) for name in sorted(os.listdir(queries_path))
+                if os.path.isfile(os.path.join(queries_path, name))]
+    with open(queries_path) as manifest_file:
+        return [os.path.join(os.path.dirname(queries_path), line.strip()) for line in manifest_file if line.strip()]
+
+# batch mode: answers every query file in queries_path, writing the results of each
+# to a file of the same name in results_dir
+def run_batch_search(dict_file, postings_file, queries_path, results_dir, k=None):
+    start_time = time.time()
+
+    index = load_search_index(dict_file, postings_file)
+    query_files = batch_query_files(queries_path)
+    contents = []
+    for query_file_name in query_files:
+        with open(query_file_name) as query_file:
+            contents.append(query_file.readlines())
+    os.makedirs(results_dir, exist_ok=True)
+    for query_file_name, result_chunks in zip(query_files, search_queries(index, contents, k)):
+        write_to_file(result_chunks, os.path.join(results_dir, os.path.basename(query_file_name)))
+
+    end_time = time.time()
+    print("done.")
+    print(len(query_files), "result files generated in", results_dir + ".")
+    print("search completed in", round(end_time - start_time, 5), "secs.")
+
+# main function to run search: loads the index, answers the query in queries_file
+# and writes the matching documents to results_file
+def run_search(dict_file, postings_file, queries_file, results_file, k=None):
+    # time search
+    start_time = time.time()
+
+    index = load_search_index(dict_file, postings_file)
+    with open(queries_file) as query_file:
+        content = query_file.readlines()
+    write_to_file(search_query(index, content, k), results_file)
 
     # stop timer
     end_time = time.time()
@@ -233,28 +437,42 @@ def run_search(dict_file, postings_file, queries_file, results_file):
     print("search completed in", round(end_time - start_time, 5), "secs.")
     #print(matrix.shape)
 
-dictionary_file = postings_file = file_of_queries = output_file_of_results = None
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-d':
-        dictionary_file = a
-    elif o == '-p':
-        postings_file = a
-    elif o == '-q':
-        file_of_queries = a
-    elif o == '-o':
-        file_of_output = a
-    else:
-        assert False, "unhandled option"
+if __name__ == '__main__':
+    dictionary_file = postings_file = file_of_queries = file_of_output = batch_queries = top_k = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:b:k:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            file_of_queries = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '-b':
+            batch_queries = a
+        elif o == '-k':
+            try:
+                top_k = int(a)
+            except ValueError:
+                top_k = 0
+        else:
+            assert False, "unhandled option"
 
-if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None:
-    usage()
-    sys.exit(2)
+    if dictionary_file == None or postings_file == None or file_of_output == None or (file_of_queries == None) == (batch_queries == None):
+        usage()
+        sys.exit(2)
+    if top_k != None and top_k < 1:
+        print("-k must be at least 1")
+        sys.exit(2)
 
-run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+    if batch_queries != None:
+        run_batch_search(dictionary_file, postings_file, batch_queries, file_of_output, top_k)
+        sys.exit(0)
+    run_search(dictionary_file, postings_file, file_of_queries, file_of_output, top_k)
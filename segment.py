@@ -0,0 +1,122 @@
+import os
+import sys
+import mmap
+import zlib
+import struct
+
+#### SEGMENT FORMAT (single file, little-endian)
+# header: magic, format version, number of sections
+# section table: name (NUL-padded utf-8), byte offset, byte length and crc32 of every section
+# sections follow the table, each starting on a 64-byte boundary
+#
+# a section holds one structure of the index in the format of the file it used to be stored in
+# (matrix, vocabulary, doc map, positional index, ...), so each is read straight from the mapped
+# segment the same way as from its own file. opening a segment only reads the header and section
+# table; pages of a section are read from disk when it is used. checksums are only checked by
+# verify (see the command line below), as checking a section means reading all of it
+
+MAGIC = b"SEGMENT\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+SECTION = struct.Struct("<16sQQI4x")
+ALIGNMENT = 64
+# sections are copied into a segment this many bytes at a time
+COPY_SIZE = 1 << 20
+
+# sections of an index segment, in the order they are written
+# scales, ngrams and synonyms are optional: only indexes built with --quantize uint8/uint16 (--ngrams,
+# or with WordNet data) have them
+SECTIONS = ("matrix", "columns", "impacts", "scales", "vocabulary", "docmap", "positions", "ngrams", "synonyms",
+            "stems", "tombstones")
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+# read-only view of a segment held in a buffer (normally a mmap of the segment file)
+class Segment:
+    def __init__(self, buffer):
+        magic, version, _, n_sections = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not an index segment (or unsupported version)")
+        self.buffer = buffer
+        # section name -> (offset, length, crc32)
+        self.sections = {}
+        for i in range(n_sections):
+            name, offset, length, checksum = SECTION.unpack_from(buffer, HEADER.size + i * SECTION.size)
+            self.sections[name.rstrip(b"\0").decode("utf-8")] = (offset, length, checksum)
+
+    # one open and a header read; raises ValueError for files that are not segments
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as segment_file:
+            if segment_file.read(len(MAGIC)) != MAGIC:
+                raise ValueError("not an index segment: " + path)
+            buffer = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    # bytes of a section, without copying them out of the mapped file
+    def section(self, name):
+        offset, length, _ = self.sections[name]
+        return memoryview(self.buffer)[offset:offset + length]
+
+    # whether a section's bytes still match the checksum it was written with
+    def verify(self, name):
+        return zlib.crc32(self.section(name)) == self.sections[name][2]
+
+# chunks of a section's bytes; source is the path of a file, or a buffer (e.g. a section of another segment)
+def section_chunks(source):
+    if isinstance(source, str):
+        with open(source, "rb") as source_file:
+            for chunk in iter(lambda: source_file.read(COPY_SIZE), b""):
+                yield chunk
+    else:
+        source = memoryview(source).cast("B")
+        for start in range(0, len(source), COPY_SIZE):
+            yield source[start:start + COPY_SIZE]
+
+def section_length(source):
+    return os.path.getsize(source) if isinstance(source, str) else memoryview(source).nbytes
+
+# write a segment of sections, a list of (name, source) pairs (see section_chunks)
+# written to a temp file first, as the segment may be mapped from the file being replaced
+def write_segment(path, sections):
+    offsets = []
+    offset = HEADER.size + len(sections) * SECTION.size
+    for _, source in sections:
+        offset = align(offset)
+        offsets.append(offset)
+        offset += section_length(source)
+
+    temp_path = os.path.join(os.path.dirname(path), "temp-" + os.path.basename(path))
+    table = []
+    with open(temp_path, "wb") as segment_file:
+        segment_file.write(b"\0" * (HEADER.size + len(sections) * SECTION.size))
+        for (name, source), offset in zip(sections, offsets):
+            segment_file.write(b"\0" * (offset - segment_file.tell()))
+            checksum = 0
+            for chunk in section_chunks(source):
+                checksum = zlib.crc32(chunk, checksum)
+                segment_file.write(chunk)
+            table.append(SECTION.pack(name.encode("utf-8"), offset, segment_file.tell() - offset, checksum))
+        # header and section table are written last, once the checksums are known
+        segment_file.seek(0)
+        segment_file.write(HEADER.pack(MAGIC, VERSION, 0, len(sections)))
+        segment_file.write(b"".join(table))
+    os.replace(temp_path, path)
+
+# list the sections of a segment and check their checksums
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("usage: " + sys.argv[0] + " segment-file")
+        sys.exit(2)
+    segment = Segment.open(sys.argv[1])
+    corrupt = 0
+    for name, (offset, length, checksum) in segment.sections.items():
+        ok = segment.verify(name)
+        corrupt += not ok
+        print(name.ljust(12), str(length).rjust(12), "bytes at", str(offset).rjust(12), "crc32", format(checksum, "08x"),
+              "ok" if ok else "CORRUPT")
+    sys.exit(1 if corrupt else 0)
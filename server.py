@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import getopt
+import itertools
+import threading
+import socketserver
+import multiprocessing
+from multiprocessing import shared_memory
+import search
+from segment import Segment
+
+# default socket file, shared with client.py
+SOCKET_FILE = 'search.sock'
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-s socket-file] [-w number-of-workers]")
+
+#### PROTOCOL
+# one JSON object per line, in both directions; a connection can carry any number of queries
+# request:  {"query": [lines of a query file], "k": n}  (query, then relevance judgments; k is optional)
+# response: {"results": [docIds in ranked order]}  or  {"error": message}
+
+# answers each query on a connection in turn
+class SearchHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = {"results": self.server.search(request["query"], request.get("k"))}
+            except Exception as e:
+                response = {"error": type(e).__name__ + ": " + str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+# keeps the index loaded between queries; reloads it when index.py has rewritten any of its files
+class SearchServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_file, dict_file, postings_file):
+        self.dict_file = dict_file
+        self.postings_file = postings_file
+        # search only reads the segment at the postings path; the dictionary file is a manifest of it
+        self.index_files = [postings_file]
+        self.load()
+        # a socket file left behind by a server that was killed would make bind fail
+        if os.path.exists(socket_file):
+            os.remove(socket_file)
+        super().__init__(socket_file, SearchHandler)
+
+    # modification times of the index files (None for missing files)
+    def index_mtimes(self):
+        return [os.stat(path).st_mtime_ns if os.path.exists(path) else None for path in self.index_files]
+
+    def load(self):
+        self.mtimes = self.index_mtimes()
+        self.index = search.load_search_index(self.dict_file, self.postings_file)
+
+    # same ranking as search.py, without loading the index again
+    def search(self, content, k=None):
+        if self.index_mtimes() != self.mtimes:
+            print("index changed, reloading...")
+            self.load()
+        return list(itertools.chain.from_iterable(search.search_query(self.index, content, k)))
+
+#### WORKER POOL (-w)
+# the server copies the index segment into shared memory once; every worker process attaches to it and
+# wraps its sections in place (search.load_segment), so the matrix, postings and other arrays exist
+# once however many workers there are; that includes the stem cache, whose saved words are looked up in
+# the shared table. each worker only has its own interpreter, the words it has stemmed and the
+# per-query scratch arrays of its scorer
+# connections are handled in threads that hand their queries to the pool, so queries run in parallel
+
+# index of this worker process, and the shared memory it is read from
+worker_index = None
+worker_memory = None
+
+def attach_index(memory_name):
+    global worker_index, worker_memory
+    worker_memory = shared_memory.SharedMemory(memory_name)
+    worker_index = search.load_segment(Segment(worker_memory.buf))
+
+def worker_search(content, k):
+    return list(itertools.chain.from_iterable(search.search_query(worker_index, content, k)))
+
+# copy of the segment at postings_file in new shared memory
+def share_segment(postings_file):
+    search.open_segment(postings_file)
+    size = os.path.getsize(postings_file)
+    memory = shared_memory.SharedMemory(create=True, size=size)
+    with open(postings_file, "rb") as segment_file:
+        segment_file.readinto(memory.buf[:size])
+    return memory
+
+def release(memory):
+    if memory is not None:
+        memory.close()
+        memory.unlink()
+
+# answers queries in a pool of worker processes that share one copy of the index
+class PoolSearchServer(socketserver.ThreadingMixIn, SearchServer):
+    daemon_threads = True
+
+    def __init__(self, socket_file, dict_file, postings_file, workers):
+        self.workers = workers
+        self.pool = self.memory = None
+        # held while checking for a new index and handing a query to the pool, so queries are never
+        # given to a pool that is being replaced
+        self.lock = threading.Lock()
+        # workers are forked from a server process started before any thread, as forking a process
+        # that runs threads is unsafe; modules it imports are shared by every worker. nltk is imported
+        # by search to stem words missing from the stem cache, and takes more memory than a small index
+        # (it is skipped if it is not installed)
+        self.context = multiprocessing.get_context("forkserver")
+        self.context.set_forkserver_preload(["search", "nltk.stem.snowball"])
+        super().__init__(socket_file, dict_file, postings_file)
+
+    # share the index and start a new pool on it; the previous pool finishes the queries it was
+    # given before it and its shared memory are released
+    def load(self):
+        self.mtimes = self.index_mtimes()
+        memory = share_segment(self.postings_file)
+        pool = self.context.Pool(self.workers, attach_index, (memory.name,))
+        old_pool, old_memory = self.pool, self.memory
+        self.pool, self.memory = pool, memory
+        if old_pool is not None:
+            old_pool.close()
+            old_pool.join()
+        release(old_memory)
+
+    def search(self, content, k=None):
+        with self.lock:
+            if self.index_mtimes() != self.mtimes:
+                print("index changed, reloading...")
+                self.load()
+            result = self.pool.apply_async(worker_search, (content, k))
+        return result.get()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.terminate()
+        self.pool.join()
+        release(self.memory)
+
+if __name__ == '__main__':
+    dictionary_file = postings_file = None
+    socket_file = SOCKET_FILE
+    workers = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:s:w:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-s':
+            socket_file = a
+        elif o == '-w':  # number of worker processes answering queries
+            workers = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None:
+        usage()
+        sys.exit(2)
+
+    if workers == None:
+        server = SearchServer(socket_file, dictionary_file, postings_file)
+    else:
+        server = PoolSearchServer(socket_file, dictionary_file, postings_file, workers)
+    print("listening on", socket_file)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_file)
@@ -0,0 +1,73 @@
+import os
+import struct
+import numpy as np
+from analysis import analyze
+
+#### SYNONYMS FORMAT (single file, little-endian)
+# header: magic, format version, number of terms
+# synonyms int32[n_terms]: by matrix column, column of the term's synonym, or -1 if it has none
+#
+# search expands queries with an array lookup in this table, so WordNet is only used by index.py
+
+MAGIC = b"SYNONYMS"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+
+# one synonym per indexed term, the same way query_synonym_extension picks them from WordNet:
+# the first lemma of the word's synsets other than the word itself
+# words: every (unstemmed) word seen while indexing, e.g. the keys of the stem cache
+# column: function giving the matrix column of a term, or -1
+# a term (stem) gets the synonym of the first of its words (in sorted order) that has one in the
+# vocabulary; synonyms made of more than one term (or none) are skipped, as those never matched
+# a column when they were added to the query text either
+def build_synonyms(words, column, n_terms):
+    # WordNet's corpus reader is slow to load; only index.py needs it
+    from nltk.corpus import wordnet
+    synonyms = np.full(n_terms, -1, dtype=np.int32)
+    for word in sorted(words):
+        terms = analyze(word)
+        if len(terms) != 1 or column(terms[0]) == -1 or synonyms[column(terms[0])] != -1:
+            continue
+        for synset in wordnet.synsets(word):
+            lemmas = [lemma for lemma in synset.lemma_names() if lemma != word]
+            if lemmas:
+                synonym_terms = analyze(lemmas[0])
+                if len(synonym_terms) == 1 and column(synonym_terms[0]) not in (-1, column(terms[0])):
+                    synonyms[column(terms[0])] = column(synonym_terms[0])
+                break
+    return synonyms
+
+# written to a temp file first, as the table may be mapped from the file being replaced
+def save_synonyms(synonyms, path):
+    temp_path = os.path.join(os.path.dirname(path), "temp-" + os.path.basename(path))
+    with open(temp_path, "wb") as synonyms_file:
+        synonyms_file.write(HEADER.pack(MAGIC, VERSION, 0, len(synonyms)))
+        synonyms_file.write(np.asarray(synonyms, dtype="<i4").tobytes())
+    os.replace(temp_path, path)
+
+def synonyms_from_buffer(buffer):
+    magic, version, _, n_terms = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a synonyms file (or unsupported version)")
+    return np.frombuffer(buffer, dtype="<i4", count=n_terms, offset=HEADER.size)
+
+# add the synonym of every term of each query (rows of term counts) to that query, as many times
+# as the term occurs; synonyms that are already terms of the query are not added again
+def expand_counts(counts, synonyms):
+    indptr, indices, data = [0], [], []
+    for i in range(counts.shape[0]):
+        start, end = counts.indptr[i], counts.indptr[i + 1]
+        columns, column_counts = counts.indices[start:end], counts.data[start:end]
+        synonym_columns = synonyms[columns]
+        added = (synonym_columns != -1) & ~np.isin(synonym_columns, columns)
+        # terms mapping to the same synonym add up
+        all_columns = np.concatenate((columns, synonym_columns[added]))
+        unique_columns, positions = np.unique(all_columns, return_inverse=True)
+        unique_counts = np.zeros(len(unique_columns), dtype=counts.dtype)
+        np.add.at(unique_counts, positions, np.concatenate((column_counts, column_counts[added])))
+        indices.append(unique_columns)
+        data.append(unique_counts)
+        indptr.append(indptr[-1] + len(unique_columns))
+    return type(counts)((np.concatenate(data) if data else np.empty(0, dtype=counts.dtype),
+                         np.concatenate(indices) if indices else np.empty(0, dtype=np.int32),
+                         np.array(indptr)), shape=counts.shape)
@@ -0,0 +1,36 @@
+import os
+import gzip
+import pickle
+import struct
+import numpy as np
+
+#### TOMBSTONES FORMAT (single file, little-endian)
+# header: magic, format version, number of tombstones
+# rows int64[n_tombstones]: rows of deleted (or replaced) documents, sorted
+#
+# tombstones are filtered out by search until the index is compacted; the rows are used in place,
+# so opening an index does not decode them
+
+MAGIC = b"TOMBSTNS"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+
+# rows are written sorted, so the same tombstones always give the same bytes
+# written to a temp file first, as the tombstones may be mapped from the file being replaced
+def save_tombstones(rows, path):
+    rows = np.array(sorted(rows), dtype="<i8")
+    temp_path = os.path.join(os.path.dirname(path), "temp-" + os.path.basename(path))
+    with open(temp_path, "wb") as tomb_file:
+        tomb_file.write(HEADER.pack(MAGIC, VERSION, 0, len(rows)))
+        tomb_file.write(rows.tobytes())
+    os.replace(temp_path, path)
+
+# sorted int64 array of rows
+# tombstones saved by older builds are a gzip-pickled list of rows; those are decoded in full
+def tombstones_from_buffer(buffer):
+    if bytes(buffer[:2]) == b"\x1f\x8b":
+        return np.array(sorted(pickle.loads(gzip.decompress(buffer))), dtype=np.int64)
+    magic, version, _, n_tombstones = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a tombstones file (or unsupported version)")
+    return np.frombuffer(buffer, dtype="<i8", count=n_tombstones, offset=HEADER.size)
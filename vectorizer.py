@@ -0,0 +1,87 @@
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer, TfidfTransformer
+import analysis
+from analysis import analyze
+from vocabulary import Vocabulary
+
+# modified version of TfidfVectorizer that converts list of text to a term-doc matrix
+# modified to use float32 to save space when saved to disk, and to stem all words automatically
+# used by index.py to fit the index; search.py only needs the compact vocabulary it saves (see vocabulary.py)
+class TfidfStemVectorizer(TfidfVectorizer):
+    def __init__(self):
+        super().__init__(dtype=np.float32)
+
+    # function that processes all text passed to vectorizer when called
+    def build_analyzer(self):
+        # automatically stem all words in text passed to it
+        return analyze
+
+    # fit vectorizer from a term-count matrix that was built elsewhere (see inverter.py),
+    # instead of re-analyzing raw text; returns the same tf-idf matrix fit_transform would
+    # terms: vocabulary in sorted order, one per column of counts
+    # with lazy_idf, idf is left out of the returned document vectors (which are then just normalized tf);
+    # document frequencies are stored instead, so documents can be added later without reweighting the
+    # whole matrix, and idf is only applied to query vectors (see refresh_idf)
+    def fit_counts(self, terms, counts, lazy_idf=False):
+        self.vocabulary_ = {term: i for i, term in enumerate(terms)}
+        self.stop_words_ = set()
+        if lazy_idf:
+            self.doc_freqs_ = np.bincount(counts.indices, minlength=len(terms)).astype(np.int64)
+            self.n_docs_ = counts.shape[0]
+            self.refresh_idf()
+            return self.doc_weights(counts)
+        transformer = TfidfTransformer(norm=self.norm, use_idf=self.use_idf,
+                                       smooth_idf=self.smooth_idf, sublinear_tf=self.sublinear_tf)
+        matrix = transformer.fit_transform(counts.astype(self.dtype))
+        self.idf_ = transformer.idf_
+        return matrix
+
+    # true if idf is computed from stored document frequencies instead of being baked into the matrix
+    def lazy_idf(self):
+        return hasattr(self, "doc_freqs_")
+
+    # normalized tf document vectors, for indexes built with lazy_idf
+    def doc_weights(self, counts):
+        transformer = TfidfTransformer(norm=self.norm, use_idf=False, sublinear_tf=self.sublinear_tf)
+        return transformer.fit_transform(counts.astype(self.dtype))
+
+    # recompute idf from stored document frequencies, using the same (smoothed) formula as scikit-learn
+    def refresh_idf(self):
+        idf = np.log((1 + self.n_docs_) / (1 + self.doc_freqs_)) + 1
+        self.idf_ = idf.astype(self.dtype)
+
+    # give columns to terms not yet in vocabulary; returns the column of every term in terms
+    def extend_vocabulary(self, terms):
+        for term in terms:
+            if term not in self.vocabulary_:
+                self.vocabulary_[term] = len(self.vocabulary_)
+        self.doc_freqs_ = np.concatenate((self.doc_freqs_, np.zeros(len(self.vocabulary_) - len(self.doc_freqs_), dtype=np.int64)))
+        return np.array([self.vocabulary_[term] for term in terms], dtype=np.int64)
+
+    # save what search needs to vectorize queries as a compact vocabulary file
+    # matrix is used to count document frequencies when they are not stored on the vectorizer
+    def save_vocabulary(self, path, matrix):
+        terms = list(self.vocabulary_)
+        columns = [self.vocabulary_[term] for term in terms]
+        if self.lazy_idf():
+            doc_freqs, n_docs = self.doc_freqs_, self.n_docs_
+        else:
+            doc_freqs, n_docs = np.bincount(matrix.indices, minlength=len(terms)), matrix.shape[0]
+        config = {"lowercase": True, "token_pattern": analysis.token_pattern.pattern,
+                  "stemmer": analysis.stem_cache.backend, "norm": self.norm,
+                  "sublinear_tf": self.sublinear_tf, "lazy_idf": self.lazy_idf()}
+        Vocabulary.write(path, terms, columns, self.idf_, doc_freqs, n_docs, config)
+
+    # rebuild a fitted vectorizer from a saved vocabulary, e.g. to update an index incrementally
+    @classmethod
+    def from_vocabulary(cls, vocabulary):
+        vectorizer = cls()
+        vectorizer.vocabulary_ = {vocabulary.terms[i]: int(vocabulary.columns[i]) for i in range(vocabulary.n_terms)}
+        vectorizer.stop_words_ = set()
+        if vocabulary.config["lazy_idf"]:
+            vectorizer.doc_freqs_ = np.array(vocabulary.doc_freqs, dtype=np.int64)
+            vectorizer.n_docs_ = vocabulary.n_docs
+            vectorizer.refresh_idf()
+        else:
+            vectorizer.idf_ = np.array(vocabulary.idf)
+        return vectorizer
@@ -0,0 +1,143 @@
+import os
+import json
+import struct
+import bisect
+import numpy as np
+from scipy import sparse
+from analysis import analyze
+
+#### VOCABULARY FORMAT (single file, little-endian)
+# everything search needs to turn a query into a vector, without scikit-learn:
+# header: magic, format version, number of terms, number of documents, byte offsets of the sections below
+# term offsets int64[n_terms + 1] and utf-8 term blob: terms in sorted order
+# columns int64[n_terms]: matrix column of each sorted term
+# idf float32[n_terms], doc frequencies int64[n_terms]: by column
+# config: json object with tokenizer/stemmer/weighting settings
+
+MAGIC = b"VOCAB\0\0\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQQQQQQQ")
+
+# read-only sequence of the sorted terms, decoding a term from the blob only when it is indexed,
+# so a lookup (a binary search) decodes about log2(n_terms) terms
+class TermList:
+    def __init__(self, buffer, term_offsets, blob_offset):
+        self.buffer = buffer
+        self.term_offsets = term_offsets
+        self.blob_offset = blob_offset
+
+    def __len__(self):
+        return len(self.term_offsets) - 1
+
+    def __getitem__(self, i):
+        start = self.blob_offset + int(self.term_offsets[i])
+        end = self.blob_offset + int(self.term_offsets[i + 1])
+        return bytes(self.buffer[start:end]).decode("utf-8")
+
+# query-time vocabulary and idf; turns query text into tf-idf vectors like TfidfStemVectorizer.transform
+class Vocabulary:
+    def __init__(self, buffer):
+        (magic, version, _, n_terms, n_docs, term_offsets_offset, blob_offset, columns_offset,
+         idf_offset, doc_freqs_offset, config_offset, config_length) = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a vocabulary file (or unsupported version)")
+        self.n_terms = n_terms
+        self.n_docs = n_docs
+        term_offsets = np.frombuffer(buffer, dtype="<i8", count=n_terms + 1, offset=term_offsets_offset)
+        self.terms = TermList(buffer, term_offsets, blob_offset)
+        self.columns = np.frombuffer(buffer, dtype="<i8", count=n_terms, offset=columns_offset)
+        self.idf = np.frombuffer(buffer, dtype="<f4", count=n_terms, offset=idf_offset)
+        self.doc_freqs = np.frombuffer(buffer, dtype="<i8", count=n_terms, offset=doc_freqs_offset)
+        self.config = json.loads(bytes(buffer[config_offset:config_offset + config_length]).decode("utf-8"))
+        # indexes built with --lazy-idf store document frequencies instead of idf; compute idf from them now
+        if self.config["lazy_idf"]:
+            self.refresh_idf()
+
+    # write vocabulary; terms and columns: every term with its matrix column (any order)
+    # idf and doc_freqs are indexed by column
+    # written to a temp file first, as the vocabulary may be mapped from the file being replaced
+    @staticmethod
+    def write(path, terms, columns, idf, doc_freqs, n_docs, config):
+        order = sorted(range(len(terms)), key=lambda i: terms[i])
+        encoded_terms = [terms[i].encode("utf-8") for i in order]
+        term_offsets = np.zeros(len(terms) + 1, dtype="<i8")
+        np.cumsum([len(term) for term in encoded_terms], out=term_offsets[1:])
+        blob = b"".join(encoded_terms)
+        sorted_columns = np.asarray(columns, dtype="<i8")[order] if order else np.empty(0, dtype="<i8")
+        config_bytes = json.dumps(config, sort_keys=True).encode("utf-8")
+
+        term_offsets_offset = HEADER.size
+        blob_offset = term_offsets_offset + term_offsets.nbytes
+        # keep numeric sections 8-byte aligned
+        columns_offset = (blob_offset + len(blob) + 7) // 8 * 8
+        idf_offset = columns_offset + 8 * len(terms)
+        doc_freqs_offset = (idf_offset + 4 * len(terms) + 7) // 8 * 8
+        config_offset = doc_freqs_offset + 8 * len(terms)
+        temp_path = os.path.join(os.path.dirname(path), "temp-" + os.path.basename(path))
+        with open(temp_path, "wb") as vocab_file:
+            vocab_file.write(HEADER.pack(MAGIC, VERSION, 0, len(terms), n_docs, term_offsets_offset, blob_offset,
+                                         columns_offset, idf_offset, doc_freqs_offset, config_offset, len(config_bytes)))
+            vocab_file.write(term_offsets.tobytes())
+            vocab_file.write(blob)
+            vocab_file.write(b"\0" * (columns_offset - vocab_file.tell()))
+            vocab_file.write(sorted_columns.tobytes())
+            vocab_file.write(np.asarray(idf, dtype="<f4").tobytes())
+            vocab_file.write(b"\0" * (doc_freqs_offset - vocab_file.tell()))
+            vocab_file.write(np.asarray(doc_freqs, dtype="<i8").tobytes())
+            vocab_file.write(config_bytes)
+        os.replace(temp_path, path)
+
+    # same smoothed idf formula as scikit-learn, from stored document frequencies
+    def refresh_idf(self):
+        self.idf = (np.log((1 + self.n_docs) / (1 + self.doc_freqs)) + 1).astype(np.float32)
+
+    # matrix column of term, or -1 if term is not in vocabulary
+    def column(self, term):
+        i = bisect.bisect_left(self.terms, term)
+        if i < self.n_terms and self.terms[i] == term:
+            return int(self.columns[i])
+        return -1
+
+    def __contains__(self, term):
+        return self.column(term) != -1
+
+    # same analyzer the index was built with (stemmer is picked through analysis.set_stem_cache)
+    def build_analyzer(self):
+        return analyze
+
+    # (len(texts) x n_terms) matrix of l2-normalized tf-idf query vectors
+    def transform(self, texts):
+        return self.weight(self.count(texts))
+
+    # (len(texts) x n_terms) matrix of raw term counts; words not in vocabulary are ignored
+    def count(self, texts):
+        indptr = [0]
+        indices = []
+        data = []
+        columns = {}
+        for text in texts:
+            counts = {}
+            for term in analyze(text):
+                if term not in columns:
+                    columns[term] = self.column(term)
+                if columns[term] != -1:
+                    counts[columns[term]] = counts.get(columns[term], 0) + 1
+            for column in sorted(counts):
+                indices.append(column)
+                data.append(counts[column])
+            indptr.append(len(indices))
+        return sparse.csr_matrix((np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32),
+                                  np.array(indptr, dtype=np.int32)), shape=(len(texts), self.n_terms))
+
+    # apply tf scaling, idf and normalization to a matrix of raw term counts
+    def weight(self, vectors):
+        if self.config["sublinear_tf"]:
+            np.log(vectors.data, out=vectors.data)
+            vectors.data += 1
+        vectors.data *= self.idf[vectors.indices]
+        if self.config["norm"] == "l2":
+            row_lengths = np.diff(vectors.indptr)
+            rows = np.repeat(np.arange(vectors.shape[0]), row_lengths)
+            norms = np.sqrt(np.bincount(rows, weights=vectors.data ** 2, minlength=vectors.shape[0]))
+            vectors.data /= np.repeat(norms, row_lengths).astype(np.float32)
+        return vectors